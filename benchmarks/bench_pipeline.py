@@ -0,0 +1,302 @@
+##########################################################################################
+# Description: Offline latency benchmark of the question generation path, run against
+# the mock LLM and embedding functions and the bundled RadioGraphics articles.
+##########################################################################################
+
+import argparse
+import datetime
+import json
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+import radqg.configs as configs
+from radqg.cleaning import clean_articles
+from radqg.generator import Generator, split_article
+from radqg.leakage import check_leakage
+from radqg.llm import mock
+from radqg.llm.local import LocalEmbedding
+from radqg.parse_html import get_caption_body, retrieve_figures, retrieve_articles
+from radqg.prompts import get_generator_prompt
+from radqg.prompts import get_contenteditor_prompt, get_formateditor_prompt
+
+QUESTION_TYPES = ["MCQ", "Short-Answer", "Long-Answer"]
+
+# ----------------------------------------------------------------------------------------
+# Helper Functions
+# ----------------------------------------------------------------------------------------
+
+
+# ----------------------------------------------------------------------------------------
+# percentile
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Computes the q-th percentile (0-100) of a list with linear interpolation."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+# ----------------------------------------------------------------------------------------
+# summarize
+
+
+def summarize(samples: dict[str, list[float]]) -> dict[str, dict]:
+    """Summarizes the timings (in seconds) of each phase in milliseconds."""
+    summary = dict()
+    for phase, values in samples.items():
+        if not values:
+            continue
+        summary[phase] = {
+            "n": len(values),
+            "mean_ms": 1000 * sum(values) / len(values),
+            "p50_ms": 1000 * percentile(values, 50),
+            "p95_ms": 1000 * percentile(values, 95),
+            "p99_ms": 1000 * percentile(values, 99),
+            "max_ms": 1000 * max(values),
+        }
+    return summary
+
+
+# ----------------------------------------------------------------------------------------
+# timed
+
+
+def timed(samples: dict, phase: str, fn: callable, *args, **kwargs):
+    """Calls a function and records its duration under the given phase."""
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    samples.setdefault(phase, list()).append(time.perf_counter() - start)
+    return out
+
+
+# ----------------------------------------------------------------------------------------
+# git_commit
+
+
+def git_commit() -> str:
+    """Returns the current git commit of the repository, if available."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ----------------------------------------------------------------------------------------
+# Benchmarks
+# ----------------------------------------------------------------------------------------
+
+
+# ----------------------------------------------------------------------------------------
+# bench_ingestion
+
+
+def bench_ingestion(
+    samples: dict, data_dir: str, repeats: int, retrieval_mode: str, embedding: str
+) -> Generator:
+    """Benchmarks parsing, chunking, and collection building; returns the last
+    generator that was built."""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=configs.CHUNK_SIZE, chunk_overlap=configs.CHUNK_OVERLAP
+    )
+    for repeat in range(repeats):
+        article_list = timed(samples, "parse_articles", retrieve_articles, data_dir)
+        article_list, _ = timed(samples, "cleaning", clean_articles, article_list)
+        timed(samples, "parse_figures", retrieve_figures, data_dir)
+        timed(
+            samples,
+            "chunking",
+            lambda: [split_article(article, text_splitter) for article in article_list],
+        )
+        generator = timed(
+            samples,
+            "collection_build",
+            Generator,
+            data_dir=data_dir,
+            embed_fn=mock.embed_fn if embedding == "mock" else LocalEmbedding(),
+            collection_name=f"bench_{repeat}_{time.time_ns()}",
+            retrieval_mode=retrieval_mode,
+        )
+    return generator
+
+
+# ----------------------------------------------------------------------------------------
+# bench_generation
+
+
+def bench_generation(samples: dict, generator: Generator, repeats: int, topic: str):
+    """Benchmarks the question bank setup, figure selection, retrieval (the query of
+    the chunks, the figure mention lookup, and the context cache on their own), prompt
+    construction, leakage check, and each qa stage."""
+
+    for _ in range(repeats):
+        timed(samples, "setup_qbank", generator.setup_qbank)
+        timed(samples, "setup_qbank_topic", generator.setup_qbank, topic)
+
+    qbank = generator.setup_qbank(topic)
+    for i in range(repeats):
+        article_name, figpath, caption = timed(
+            samples,
+            "select_figure",
+            generator.select_figure,
+            qbank,
+            max_q_per_fig=repeats,
+        )
+        type_of_question = QUESTION_TYPES[i % len(QUESTION_TYPES)]
+        fignum = figpath.split("/")[-1].split(".")[-2]
+
+        # Timing the stages of qa through its progress events
+        marks = list()
+
+        def on_event(event: dict):
+            if event["event"] == "stage":
+                marks.append((event["stage"], time.perf_counter()))
+
+        def timed_qa(*args, **kwargs):
+            start = time.perf_counter()
+            out = mock.qa(*args, on_event=on_event, **kwargs)
+            end = time.perf_counter()
+            samples.setdefault("qa_total", list()).append(end - start)
+            for (stage, t0), (_, t1) in zip(marks, marks[1:] + [(None, end)]):
+                samples.setdefault(f"qa_{stage}", list()).append(t1 - t0)
+            return out
+
+        try:
+            _, out1, _, _, context, _, _ = generator.generate_qa(
+                timed_qa,
+                article_name,
+                figpath,
+                caption,
+                type_of_question,
+                complete_return=True,
+            )
+        except AssertionError:
+            continue
+
+        # Timing the ways of getting a context on their own, since generate_qa serves
+        # most contexts from the cache or from the paragraphs mentioning the figure
+        timed(
+            samples,
+            "retrieval",
+            generator._query_context,
+            article_name,
+            get_caption_body(caption),
+            generator.retrieval_mode,
+        )
+        timed(
+            samples,
+            "figure_mentions",
+            generator._get_mentioned_context,
+            article_name,
+            caption,
+        )
+        timed(
+            samples,
+            "context_cache",
+            generator._retrieve_context,
+            article_name,
+            caption,
+            generator.retrieval_mode,
+        )
+
+        # Timing the prompt construction and the leakage check on their own
+        timed(
+            samples,
+            "prompt_generator",
+            get_generator_prompt,
+            fignum,
+            caption,
+            context,
+            type_of_question,
+        )
+        timed(
+            samples,
+            "prompt_content_editor",
+            get_contenteditor_prompt,
+            caption,
+            out1,
+            type_of_question,
+        )
+        timed(samples, "prompt_format_editor", get_formateditor_prompt, out1)
+        timed(samples, "leakage_check", check_leakage, out1, caption, type_of_question)
+
+
+# ----------------------------------------------------------------------------------------
+# main
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline latency benchmark of the question generation path."
+    )
+    parser.add_argument("--data-dir", default=configs.TOY_DATA_DIR)
+    parser.add_argument("--build-repeats", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=100)
+    parser.add_argument("--topic", default="small bowel obstruction")
+    parser.add_argument("--stage-latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--retrieval-mode",
+        default=configs.RETRIEVAL_MODE,
+        choices=["vector", "lexical", "hybrid"],
+    )
+    parser.add_argument("--embedding", default="mock", choices=["mock", "local"])
+    parser.add_argument("--output", help="Path of the JSON file to write.")
+    args = parser.parse_args()
+
+    stages = ["generator", "content_editor", "format_editor"]
+    mock.configure(
+        seed=configs.MOCK_SEED,
+        stage_latencies={stage: (args.stage_latency, 0.5) for stage in stages},
+        failure_rates={stage: args.failure_rate for stage in stages},
+    )
+
+    samples = dict()
+    with tempfile.TemporaryDirectory() as vector_db_dir:
+        configs.VECTOR_DB_DIR = vector_db_dir
+        generator = bench_ingestion(
+            samples,
+            args.data_dir,
+            args.build_repeats,
+            args.retrieval_mode,
+            args.embedding,
+        )
+        bench_generation(samples, generator, args.repeats, args.topic)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "num_articles": len(generator.article_list),
+            "num_figures": len(generator.fig_list),
+        },
+        "results": summarize(samples),
+    }
+
+    print(f"{'phase':<24}{'n':>6}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for phase, stats in results["results"].items():
+        print(
+            f"{phase:<24}{stats['n']:>6}{stats['p50_ms']:>12.3f}"
+            f"{stats['p95_ms']:>12.3f}{stats['p99_ms']:>12.3f}"
+        )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,15 +13,24 @@ sys.path.append("../")
 import gradio as gr
 import openai
 import radqg.configs as configs
+import radqg.tracing as tracing
+from radqg.cancellation import CancellationToken, CancelledError
 from radqg.generator import Generator
 from radqg.llm.openai import embed_fn as openai_embed_fn
 from radqg.llm.openai import qa as openai_qa
 from radqg.parse_html import retrieve_figures, retrieve_articles
+from radqg.prefetch import QuestionPrefetcher
 
 # ----------------------------------------------------------------------------------------
 # Helper Functions
 # ----------------------------------------------------------------------------------------
 
+PLACEHOLDER_PATH = "../data/fig_placeholder.png"
+NO_MORE_FIGURES_MESSAGE = (
+    "All the figures of the selected articles have been used; no more questions can "
+    "be generated."
+)
+
 
 # ----------------------------------------------------------------------------------------
 # remove vector_db
@@ -35,14 +44,44 @@ def remove_vector_db():
             )
 
 
+# ----------------------------------------------------------------------------------------
+# _partial_question
+
+STAGE_MESSAGES = {
+    "retrieval": "Retrieving the relevant parts of the article...",
+    "generator": "Drafting the question...",
+    "content_editor": "Editing the question...",
+    "format_editor": "Formatting the question...",
+}
+
+
+def _partial_question(streamed_text: str) -> str:
+    """Extracts the (possibly incomplete) question from a streamed dictionary string,
+    without revealing the options or the answer."""
+    match = re.search(
+        r"""['"]question['"]\s*:\s*['"](.*?)(?:['"]\s*,\s*['"](?:options|answer)|$)""",
+        streamed_text,
+        re.S,
+    )
+    return match.group(1) if match else ""
+
+
 # ----------------------------------------------------------------------------------------
 # generate_question
 
 
-def generate_question(question_type: str):
-    global generator, article_names, figpaths, captions, sampler
+def generate_question(question_type: str, session: dict):
+    global generator, qbank, prefetcher
+
+    # Cancelling the previous request of the session if it is still running
+    if session.get("cancel_token") is not None:
+        session["cancel_token"].cancel()
+    cancel_token = CancellationToken()
+    session["cancel_token"] = cancel_token
 
     if generator is None:
+        yield [PLACEHOLDER_PATH, "Setting up the question generator...", ""]
+
         # Selecting three articles
         articles_to_include_full_names = [
             "CT Findings of Acute Small-Bowel Entities _ RadioGraphics.html",
@@ -50,43 +89,75 @@ def generate_question(question_type: str):
             "Internal Hernias in the Era of Multidetector CT_ Correlation of Imaging and Surgical Findings _ RadioGraphics.html",
         ]
 
-        # Setting up the generator
+        # Setting up the generator, from the snapshot shared by the worker processes,
+        # which is (re)built and exported if it does not match the selected articles
         generator = Generator(
             data_dir=configs.TOY_DATA_DIR,
             embed_fn=openai_embed_fn,
             selected_articles=articles_to_include_full_names,
+            snapshot_dir=configs.SNAPSHOT_DIR,
         )
 
         # Setting up the question bank
-        article_names, figpaths, captions, sampler = generator.setup_qbank()
-
-    while True:
-        # Selecting a figure
-        article_name, figpath, caption = generator.select_figure(
-            article_names, figpaths, captions, sampler, reset_memory=False
+        qbank = generator.setup_qbank()
+
+        # Starting to prefetch questions in the background
+        prefetcher = QuestionPrefetcher(generator, openai_qa, qbank)
+        prefetcher.start()
+
+    if question_type == "Random":
+        question_type = random.choice(["MCQ", "Short-Answer", "Long-Answer"])
+    elif question_type == "Multiple choice":
+        question_type = "MCQ"
+    elif question_type == "Short answer (suitable for flash cards)":
+        question_type = "Short-Answer"
+    elif question_type == "Open-ended (suitable for essay exams)":
+        question_type = "Long-Answer"
+
+    # Serving a prefetched question if one is ready
+    item = prefetcher.pop(question_type)
+    if item is not None:
+        qa_dict, article_name, figpath = (
+            item["qa_dict"],
+            item["article_name"],
+            item["figpath"],
         )
 
-        # Generating a question
+    while item is None:
+        if cancel_token.cancelled:
+            return
 
-        if question_type == "Random":
-            question_type = random.choice(["MCQ", "Short-Answer", "Long-Answer"])
-        elif question_type == "Multiple choice":
-            question_type = "MCQ"
-        elif question_type == "Short answer (suitable for flash cards)":
-            question_type = "Short-Answer"
-        elif question_type == "Open-ended (suitable for essay exams)":
-            question_type = "Long-Answer"
+        # Selecting a figure, unless the sampler of the question bank is exhausted
+        try:
+            article_name, figpath, caption = prefetcher.select_figure()
+        except StopIteration:
+            yield [PLACEHOLDER_PATH, NO_MORE_FIGURES_MESSAGE, ""]
+            return
 
+        # Streaming the progress and the final question to the UI
+        streamed_text = ""
         try:
-            qa_dict, *_ = generator.generate_qa(
+            for event in generator.generate_qa_stream(
                 qa_fn=openai_qa,
                 article_name=article_name,
                 figpath=figpath,
                 caption=caption,
                 type_of_question=question_type,
-                complete_return=True,
-            )
-            break
+                cancel_token=cancel_token,
+            ):
+                if event["event"] in ["stage", "retry"]:
+                    streamed_text = ""
+                    yield [figpath, STAGE_MESSAGES[event["stage"]], ""]
+                elif event["event"] == "token" and event["stage"] == "format_editor":
+                    streamed_text += event["text"]
+                    partial_question = _partial_question(streamed_text)
+                    if partial_question:
+                        yield [figpath, partial_question, ""]
+                elif event["event"] == "result":
+                    item = event["result"]
+                    qa_dict = item[0]
+        except CancelledError:
+            return
         except AssertionError:
             print("AssertionError occured; trying again...")
             continue
@@ -96,7 +167,17 @@ def generate_question(question_type: str):
         question += "\n\n" + re.sub(r"(, )?([B-E]\))", r"\n\2", qa_dict["options"])
     answer = f'{qa_dict["answer"]}\n\nSource: {article_name.split(" _ RadioGraphics.html")[0]}'
 
-    return [figpath, question, answer]
+    yield [figpath, question, answer]
+
+
+# ----------------------------------------------------------------------------------------
+# stop_generation
+
+
+def stop_generation(session: dict):
+    """Cancels the running request of the session before its next stage."""
+    if session.get("cancel_token") is not None:
+        session["cancel_token"].cancel()
 
 
 # ----------------------------------------------------------------------------------------
@@ -110,7 +191,7 @@ def generate_question(question_type: str):
 def run_gui():
     remove_vector_db()
 
-    global generator, article_names, figpaths, captions, sampler
+    global generator, qbank, prefetcher
     generator = None
 
     try:
@@ -173,7 +254,7 @@ def run_gui():
                 gr.Markdown(
                     """ 
                     **To start, please select the type of question you desire and press "Generate!"**.
-                    > **Note**: Generating questions may take up to three minutes depending on the question type and the availability of the server.
+                    > **Note**: Generating questions may take up to three minutes depending on the question type and the availability of the server. The progress is shown in the question box.
                     """
                 )
 
@@ -192,9 +273,10 @@ def run_gui():
                 )
             with gr.Row():
                 generate_button = gr.Button("Generate!", elem_id="button")
+                stop_button = gr.Button("Stop")
             with gr.Row():
                 image_box = gr.Image(
-                    value="../data/fig_placeholder.png",
+                    value=PLACEHOLDER_PATH,
                     label="Figure",
                     interactive=False,
                     height=300,
@@ -218,11 +300,36 @@ def run_gui():
                     )
 
             # Events
-            generate_button.click(
+            session = gr.State(dict())
+            generate_event = generate_button.click(
                 generate_question,
-                [question_type],
+                [question_type, session],
                 [image_box, question_box, answer_box],
             )
+            stop_button.click(
+                stop_generation, [session], None, cancels=[generate_event]
+            )
+
+        with gr.TabItem("Metrics"):
+            gr.Markdown(
+                "Timings of the pipeline stages and counters of tokens, cost, retries,"
+                " and failures since the demo was started (Prometheus text format)."
+            )
+            with gr.Row():
+                refresh_button = gr.Button("Refresh", elem_id="button")
+            with gr.Row():
+                metrics_box = gr.Textbox(
+                    tracing.registry.to_prometheus(),
+                    label="Metrics",
+                    elem_id="normal",
+                    lines=20,
+                    max_lines=1000,
+                )
+
+            # Events
+            refresh_button.click(
+                lambda: tracing.registry.to_prometheus(), None, [metrics_box]
+            )
 
     try:
         app.close()
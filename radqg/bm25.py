@@ -0,0 +1,97 @@
+##########################################################################################
+# Description: A script containing an in-process BM25 index for lexical retrieval.
+##########################################################################################
+
+import collections
+import math
+import re
+
+# ----------------------------------------------------------------------------------------
+# Configurations
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = set(
+    """
+    a an and are as at be by for from has have in into is it its of on or that the
+    their there these this to was were which with who within
+    """.split()
+)
+
+# ----------------------------------------------------------------------------------------
+# tokenize
+
+
+def tokenize(text: str) -> list[str]:
+    """A function to split a text into lowercase terms without stopwords."""
+
+    return [
+        term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS
+    ]
+
+
+# ----------------------------------------------------------------------------------------
+# BM25Index
+
+
+class BM25Index:
+    """A class for an inverted index of a list of documents (e.g., the chunks of an
+    article) that ranks them for a query with the Okapi BM25 score."""
+
+    def __init__(self, documents: list[str], k1: float = 1.5, b: float = 0.75):
+        """The constructor of the BM25Index class."""
+
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+
+        # Building the postings of each term as (document index, term frequency) pairs
+        self.postings = collections.defaultdict(list)
+        doc_lengths = list()
+        for i, document in enumerate(documents):
+            terms = tokenize(document)
+            doc_lengths.append(len(terms))
+            for term, frequency in collections.Counter(terms).items():
+                self.postings[term].append((i, frequency))
+        avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+
+        # Precomputing the length normalization of each document and the idf of each term
+        self.norms = [
+            k1 * (1 - b + b * length / avg_length) if avg_length else k1
+            for length in doc_lengths
+        ]
+        num_docs = len(documents)
+        self.idf = {
+            term: math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def query(self, text: str, n_results: int) -> list[tuple[int, float]]:
+        """A method to get the indices and scores of the `n_results` documents that
+        best match a query, from the best to the worst."""
+
+        scores = collections.defaultdict(float)
+        for term in set(tokenize(text)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, frequency in self.postings[term]:
+                scores[i] += (
+                    idf * frequency * (self.k1 + 1) / (frequency + self.norms[i])
+                )
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:n_results]
+
+
+# ----------------------------------------------------------------------------------------
+# reciprocal_rank_fusion
+
+
+def reciprocal_rank_fusion(rankings: list[list], k: int = 60) -> list:
+    """A function to fuse several rankings of items (from the best to the worst) into
+    one ranking by the sum of their reciprocal ranks."""
+
+    scores = collections.defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,43 @@
+##########################################################################################
+# Description: A script containing the cancellation of in-flight question generation.
+##########################################################################################
+
+import threading
+
+# ----------------------------------------------------------------------------------------
+# CancelledError
+
+
+class CancelledError(Exception):
+    """An exception raised when the generation of a question has been cancelled."""
+
+
+# ----------------------------------------------------------------------------------------
+# CancellationToken
+
+
+class CancellationToken:
+    """A class for signaling that a request has been abandoned, so that its question
+    generation stops before its next stage (or its next streamed token)."""
+
+    def __init__(self):
+        """The constructor of the CancellationToken class."""
+
+        self._event = threading.Event()
+
+    def cancel(self):
+        """A method to cancel the request."""
+
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the request has been cancelled."""
+
+        return self._event.is_set()
+
+    def check(self):
+        """A method to raise CancelledError if the request has been cancelled."""
+
+        if self._event.is_set():
+            raise CancelledError("The question generation has been cancelled.")
@@ -0,0 +1,93 @@
+##########################################################################################
+# Description: A script containing the removal of boilerplate from the parsed articles.
+##########################################################################################
+
+import collections
+import hashlib
+import re
+import radqg.configs as configs
+from radqg.parse_html import build_article
+
+# ----------------------------------------------------------------------------------------
+# _hash_paragraph
+
+
+def _hash_paragraph(paragraph: str) -> bytes:
+    """An internal function to hash a paragraph regardless of its case, spacing, and
+    numbers (e.g., the year of a meeting in a repeated statement)."""
+
+    normalized = re.sub(r"\d+", "0", " ".join(paragraph.lower().split()))
+    return hashlib.sha1(normalized.encode()).digest()
+
+
+# ----------------------------------------------------------------------------------------
+# clean_articles
+
+
+def clean_articles(
+    article_list: list[dict],
+    excluded_sections: list[str] = configs.CLEANING_EXCLUDED_SECTIONS,
+    excluded_patterns: list[str] = configs.CLEANING_EXCLUDED_PATTERNS,
+    min_duplicate_articles: int = configs.CLEANING_MIN_DUPLICATE_ARTICLES,
+) -> tuple[list[dict], list[dict]]:
+    """A function to remove the boilerplate from a list of articles (see
+    `retrieve_articles`) before they are chunked: the sections with excluded titles
+    (and their subsections), the paragraphs that match an excluded pattern, and the
+    paragraphs found in at least `min_duplicate_articles` articles (0 keeps them).
+    Returns the cleaned articles and a report of what was removed from each article,
+    with the number of tokens approximated without loading a tokenizer."""
+
+    # Counting the articles of each paragraph
+    article_counts = collections.Counter()
+    for article in article_list:
+        article_counts.update({_hash_paragraph(p) for p in article["paragraphs"]})
+
+    excluded_sections = {title.lower() for title in excluded_sections}
+    excluded_patterns = [re.compile(pattern) for pattern in excluded_patterns]
+
+    def is_excluded(paragraph):
+        if any(pattern.search(paragraph) for pattern in excluded_patterns):
+            return True
+        count = article_counts[_hash_paragraph(paragraph)]
+        return bool(min_duplicate_articles) and count >= min_duplicate_articles
+
+    cleaned_articles, report = list(), list()
+    for article in article_list:
+        section_texts, removed_sections, num_removed_paragraphs = list(), list(), 0
+        excluded_level = None
+        for section in article["sections"]:
+            if excluded_level is not None and section["level"] > excluded_level:
+                is_section_excluded = True
+            else:
+                is_section_excluded = section["title"].lower() in excluded_sections
+                excluded_level = section["level"] if is_section_excluded else None
+            if is_section_excluded:
+                removed_sections.append(section["title"])
+                num_removed_paragraphs += len(section["paragraphs"])
+                continue
+            paragraphs = [p for p in section["paragraphs"] if not is_excluded(p)]
+            num_removed_paragraphs += len(section["paragraphs"]) - len(paragraphs)
+            section_texts.append({**section, "paragraphs": paragraphs})
+
+        cleaned_article = build_article(
+            article["article_file_path"],
+            article["article_file_name"],
+            article["article_title"],
+            section_texts,
+        )
+        cleaned_articles.append(cleaned_article)
+        removed_chars = len(article["article_full_text"]) - len(
+            cleaned_article["article_full_text"]
+        )
+        report.append(
+            {
+                "article_file_name": article["article_file_name"],
+                "removed_sections": removed_sections,
+                "removed_paragraphs": num_removed_paragraphs,
+                "removed_bytes": len(article["article_full_text"].encode())
+                - len(cleaned_article["article_full_text"].encode()),
+                "removed_tokens": removed_chars // 4,
+            }
+        )
+
+    return cleaned_articles, report
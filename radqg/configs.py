@@ -2,8 +2,14 @@
 # Description: High-level project configurations.
 ##########################################################################################
 
+import os
 from radqg.utils import redirect_path
-from radqg.apis import POURIA_OPENAI_API_KEY
+
+try:
+    from radqg.apis import POURIA_OPENAI_API_KEY
+except ImportError:
+    # Allows running offline (e.g., with the mock LLM) without the local API key file
+    POURIA_OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
 # ----------------------------------------------------------------------------------------
 # API and token configs
@@ -23,6 +29,8 @@ VERBOSE = True
 
 TOY_DATA_DIR = redirect_path("data/html_articles")
 VECTOR_DB_DIR = redirect_path("data/vector_db")
+QBANK_DB_PATH = redirect_path("data/qbank.db")
+SNAPSHOT_DIR = redirect_path("data/snapshot")  # Shared by the demo worker processes.
 
 # ----------------------------------------------------------------------------------------
 # LLM arguments
@@ -32,6 +40,144 @@ OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
 OPENAI_GENERATOR_MODEL = "gpt-4"
 OPENAI_CONTENT_EDITOR_MODEL = "gpt-4"
 OPENAI_FORMAT_EDITOR_MODEL = "gpt-4"  # "gpt-3.5-turbo" will also work.
+# Dollars per token of models that are not priced in radqg/llm/openai.py (e.g., local
+# models served by an OpenAI-compatible server, such as {"llama-2-70b-chat": 0.0}).
+CUSTOM_MODEL_PRICES = dict()
+
+# ----------------------------------------------------------------------------------------
+# LLM backend arguments
+# ----------------------------------------------------------------------------------------
+
+# Base URLs of OpenAI-compatible servers (e.g., "http://localhost:8000/v1" for a local
+# gateway); None uses the OpenAI API.
+OPENAI_CHAT_BASE_URL = None
+OPENAI_EMBEDDING_BASE_URL = None
+HTTP_POOL_SIZE = 20  # Keep-alive connections per host shared by all the API calls.
+HTTP_CONNECT_TIMEOUT = 5.0  # Seconds to establish a connection.
+
+# ----------------------------------------------------------------------------------------
+# Content editor arguments
+# ----------------------------------------------------------------------------------------
+
+# "skip": call the content editor only if a leakage is detected locally.
+# "report": always call the content editor, but record how often it could be skipped.
+# "off": always call the content editor without checking for leakage.
+LEAKAGE_CHECK_MODE = "skip"
+LEAKAGE_STRICTNESS = 0.9  # Between 0 and 1; higher values call the editor more often.
+
+# ----------------------------------------------------------------------------------------
+# Retry arguments
+# ----------------------------------------------------------------------------------------
+
+MAX_STAGE_ATTEMPTS = 3  # Maximum number of attempts for each LLM stage.
+STAGE_RETRY_BACKOFF = 1.0  # Seconds to wait before the first retry (doubled after).
+
+# ----------------------------------------------------------------------------------------
+# Rate limiting arguments
+# ----------------------------------------------------------------------------------------
+
+# Requests and tokens per minute allowed for each model; unlisted models are unlimited.
+OPENAI_RPM_LIMITS = {
+    "gpt-4": 200,
+    "gpt-3.5-turbo": 3500,
+    "text-embedding-ada-002": 3000,
+}
+OPENAI_TPM_LIMITS = {
+    "gpt-4": 40000,
+    "gpt-3.5-turbo": 90000,
+    "text-embedding-ada-002": 1000000,
+}
+OPENAI_REQUEST_TIMEOUT = 120  # Seconds before a single API call times out.
+OPENAI_MAX_RETRIES = 6
+OPENAI_RETRY_BASE_DELAY = 1.0  # Seconds; the backoff doubles after each attempt.
+OPENAI_RETRY_MAX_DELAY = 60.0
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures before failing fast.
+CIRCUIT_RESET_TIMEOUT = 30.0  # Seconds before a trial call is let through again.
+
+# ----------------------------------------------------------------------------------------
+# Model routing arguments
+# ----------------------------------------------------------------------------------------
+
+USE_MODEL_ROUTER = False  # Lets a stage fall back to another model (opt-in).
+# Models tried after the configured model of each stage, in order of preference.
+ROUTER_FALLBACK_MODELS = {
+    "generator": ["gpt-3.5-turbo"],
+    "content_editor": ["gpt-3.5-turbo"],
+    "format_editor": ["gpt-3.5-turbo"],
+}
+# Rolling mean latency (in seconds) at which a model is passed over for a stage.
+ROUTER_LATENCY_TARGETS = {
+    "generator": 60.0,
+    "content_editor": 60.0,
+    "format_editor": 30.0,
+}
+# Dollars per 1000 tokens above which a model is passed over for a stage (None: any).
+ROUTER_COST_TARGETS = {"generator": None, "content_editor": None, "format_editor": None}
+ROUTER_LATENCY_WINDOW = 300.0  # Seconds for which latency samples are kept.
+ROUTER_FALLBACK_RETRIES = 1  # API retries of a model before falling back to the next.
+
+# ----------------------------------------------------------------------------------------
+# Hedging arguments
+# ----------------------------------------------------------------------------------------
+
+USE_HEDGING = False  # Duplicates a streamed LLM call that is unusually slow.
+HEDGING_PERCENTILE = 95  # Latency percentile of a stage after which a call is hedged.
+HEDGING_MIN_SAMPLES = 20  # Latencies recorded for a stage before hedging it.
+HEDGING_MAX_RATIO = 0.1  # Maximum fraction of the calls that are hedged.
+HEDGING_WINDOW = 200  # Latencies kept for each stage and model.
+
+# ----------------------------------------------------------------------------------------
+# Mock LLM arguments
+# ----------------------------------------------------------------------------------------
+
+MOCK_EMBEDDING_DIM = 256
+MOCK_EMBEDDING_LATENCY = 0.0  # Seconds for each call to the mock embedding function.
+# Median seconds and log-normal spread of the latency of each mock LLM stage.
+MOCK_STAGE_LATENCIES = {
+    "generator": (0.0, 0.0),
+    "content_editor": (0.0, 0.0),
+    "format_editor": (0.0, 0.0),
+}
+# Probability of each mock LLM stage returning an invalid response.
+MOCK_FAILURE_RATES = {"generator": 0.0, "content_editor": 0.0, "format_editor": 0.0}
+MOCK_LEAKAGE_RATE = 0.5  # Probability of a mock generated question needing an edit.
+MOCK_SEED = 0
+
+# ----------------------------------------------------------------------------------------
+# Cleaning arguments
+# ----------------------------------------------------------------------------------------
+
+CLEAN_ARTICLES = True  # Removes the boilerplate from the articles before chunking.
+# Titles of the sections removed with their subsections (case-insensitive).
+CLEANING_EXCLUDED_SECTIONS = [
+    "References",
+    "Suggested Readings",
+    "Acknowledgment",
+    "Acknowledgments",
+    "Article History",
+    "Disclosures",
+    "Disclosures of Conflicts of Interest",
+    "SA-CME Learning Objectives",
+]
+# Regular expressions of the paragraphs removed wherever they are.
+CLEANING_EXCLUDED_PATTERNS = [
+    r"\bha(?:s|ve) (?:provided disclosures|disclosed)",
+    r"^©",
+    r"^Presented as an education exhibit",
+    r"^Recipient of an? .* award",
+    r"full digital presentation is available online",
+]
+# Paragraphs found in this many articles are removed (0 keeps them).
+CLEANING_MIN_DUPLICATE_ARTICLES = 2
+
+# ----------------------------------------------------------------------------------------
+# Local embedding arguments
+# ----------------------------------------------------------------------------------------
+
+LOCAL_EMBEDDING_DIM = 256
+LOCAL_EMBEDDING_FEATURES = 2**14  # Hashed buckets of the words and word bigrams.
+LOCAL_EMBEDDING_MAX_FIT_DOCUMENTS = 20000  # Texts sampled to fit the projection.
+LOCAL_EMBEDDING_SEED = 0
 
 # ----------------------------------------------------------------------------------------
 # Retrieval arguments
@@ -40,6 +186,45 @@ OPENAI_FORMAT_EDITOR_MODEL = "gpt-4"  # "gpt-3.5-turbo" will also work.
 NUM_RETRIEVED_CHUNKS = 3
 CHUNK_SIZE = 1500
 CHUNK_OVERLAP = 500
+# "vector": embedding search; "lexical": BM25 search (no embedding call per query);
+# "hybrid": reciprocal rank fusion of the vector and BM25 rankings.
+RETRIEVAL_MODE = "vector"
+HYBRID_NUM_CANDIDATES = 10  # Chunks ranked by each search before fusing them.
+RRF_K = 60  # Smoothing constant of the reciprocal rank fusion.
+# Builds the context of a figure from the paragraphs that reference it ("Fig 5"),
+# retrieving chunks only for the figures that are not referenced.
+USE_FIGURE_MENTIONS = True
+
+# ----------------------------------------------------------------------------------------
+# Snapshot arguments
+# ----------------------------------------------------------------------------------------
+
+# Precision of the embeddings searched in a snapshot: "float32", "float16" (half the
+# memory), or "int8" (a quarter of the memory, with a scale for each vector).
+SNAPSHOT_PRECISION = "float32"
+# Multiple of the requested results re-scored with the full-precision embeddings after
+# a float16 or int8 search (0 keeps the approximate scores).
+SNAPSHOT_RESCORE_FACTOR = 4
+
+# ----------------------------------------------------------------------------------------
+# Prefetching arguments
+# ----------------------------------------------------------------------------------------
+
+PREFETCH_DEPTH = 2  # Ready-to-serve questions kept for each question type.
+PREFETCH_NUM_WORKERS = 2
+PREFETCH_MAX_SPEND = 5.0  # Dollars; prefetching pauses once this much is spent.
+PREFETCH_ESTIMATED_COST = 0.3  # Dollars reserved per generation until one is paid.
+PREFETCH_ERROR_BACKOFF = 1.0  # Seconds; doubles after each consecutive worker error.
+PREFETCH_MAX_ERROR_BACKOFF = 60.0
+
+# ----------------------------------------------------------------------------------------
+# Question bank store arguments
+# ----------------------------------------------------------------------------------------
+
+QBANK_QUESTIONS_PER_FIGURE = 1  # Questions stored for each figure and question type.
+QBANK_QUESTIONS_PER_CALL = 1  # Questions asked from the LLMs in one pipeline run.
+QBANK_MAX_ATTEMPTS = 3  # Failed pipeline runs of a figure and type before skipping.
+QBANK_PAGE_SIZE = 1000  # Caption entries loaded per page when setting up a bank.
 
 # ----------------------------------------------------------------------------------------
 # GradIO arguments
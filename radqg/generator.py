@@ -3,12 +3,95 @@
 ##########################################################################################
 
 import datetime
-import random
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
 from typing import Union
 import chromadb
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import radqg.configs as configs
-from radqg.parse_html import retrieve_figures, retrieve_articles
+import radqg.tracing as tracing
+from radqg.bm25 import BM25Index, reciprocal_rank_fusion
+from radqg.cancellation import CancellationToken
+from radqg.cleaning import clean_articles
+from radqg.parse_html import get_caption_body, retrieve_figures, retrieve_articles
+from radqg.qbank import QBank, get_panels
+from radqg.singleflight import SingleFlight
+from radqg.snapshot import (
+    COLUMNS_FILE_NAME,
+    EMBEDDING_FILE_NAME,
+    SnapshotCollection,
+    StaleSnapshotError,
+    corpus_fingerprint,
+    embedding_signature,
+    publish_snapshot,
+    read_snapshot,
+    staging_snapshot_dir,
+    write_snapshot,
+)
+
+
+# ----------------------------------------------------------------------------------------
+# split_article
+
+
+def split_article(
+    article: dict, text_splitter: RecursiveCharacterTextSplitter
+) -> tuple[list[str], list[str]]:
+    """A function to split the text of an article (see `retrieve_articles`) into
+    chunks that do not cross the boundaries of its sections. Returns the chunks and the
+    titles of their sections."""
+
+    chunks, section_titles = list(), list()
+    for section in article["sections"]:
+        section_text = article["article_full_text"][section["start"] : section["end"]]
+        for chunk in text_splitter.split_text(section_text):
+            chunks.append(chunk)
+            section_titles.append(section["title"])
+    return chunks, section_titles
+
+
+# ----------------------------------------------------------------------------------------
+# rank_chunks
+
+
+def rank_chunks(
+    caption: str,
+    index: BM25Index,
+    collection: chromadb.Collection,
+    retrieval_mode: str,
+    num_candidates: int,
+) -> list[int]:
+    """A function to rank the chunks of an article for a caption with their BM25
+    `index` ("lexical"), their `collection` ("vector"), or both ("hybrid", fused by
+    their reciprocal ranks). A lexical ranking falls back to the vector one if no chunk
+    shares a term with the caption.
+
+    >>> from types import SimpleNamespace
+    >>> index = BM25Index(["a dilated small bowel", "a normal liver"])
+    >>> collection = SimpleNamespace(
+    ...     query=lambda query_texts, n_results: {"metadatas": [[{"chunk_index": 1}]]}
+    ... )
+    >>> rank_chunks("Small bowel obstruction", index, collection, "lexical", 1)
+    [0]
+    >>> rank_chunks("Axial CT image", index, collection, "lexical", 1)
+    [1]
+    """
+
+    rankings, lexical_ranking = list(), None
+    if retrieval_mode in ["lexical", "hybrid"]:
+        lexical_ranking = [i for i, _ in index.query(caption, num_candidates)]
+    if retrieval_mode in ["vector", "hybrid"] or not lexical_ranking:
+        out = collection.query(query_texts=caption, n_results=num_candidates)
+        rankings.append([metadata["chunk_index"] for metadata in out["metadatas"][0]])
+    if lexical_ranking:
+        rankings.append(lexical_ranking)
+    if len(rankings) > 1:
+        return reciprocal_rank_fusion(rankings, k=configs.RRF_K)
+    return rankings[0]
 
 
 # ----------------------------------------------------------------------------------------
@@ -33,9 +116,18 @@ class Generator:
         generator_model: str = configs.OPENAI_GENERATOR_MODEL,
         content_editor_model: str = configs.OPENAI_CONTENT_EDITOR_MODEL,
         format_editor_model: str = configs.OPENAI_FORMAT_EDITOR_MODEL,
+        retrieval_mode: str = configs.RETRIEVAL_MODE,
+        snapshot_dir: str = None,
+        snapshot_precision: str = configs.SNAPSHOT_PRECISION,
+        use_figure_mentions: bool = configs.USE_FIGURE_MENTIONS,
     ):
-        """The constructor of the Generator class."""
+        """The constructor of the Generator class. If a `snapshot_dir` is given, the
+        collections are opened from the snapshot saved there (see `export_snapshot`),
+        searched with embeddings of the `snapshot_precision`, instead of being built
+        from the articles of `data_dir`, unless the snapshot was built from another
+        corpus, in which case they are built and exported there again."""
 
+        assert retrieval_mode in ["vector", "lexical", "hybrid"]
         self.data_dir = data_dir
         self.embed_fn = embed_fn
         self.chunk_size = chunk_size
@@ -44,30 +136,87 @@ class Generator:
         self.collection_name = collection_name
         self.selected_articles = selected_articles
         self.generator_memory = dict()
-        self.collection = self.create_collection()
+        self.context_cache = dict()
+        self.single_flight = SingleFlight()
+        if snapshot_dir is not None:
+            self.collection = self._open_snapshot(snapshot_dir, snapshot_precision)
+        else:
+            self.collection = self.create_collection()
         self.generator_model = generator_model
         self.content_editor_model = content_editor_model
         self.format_editor_model = format_editor_model
+        self.retrieval_mode = retrieval_mode
+        self.use_figure_mentions = use_figure_mentions
 
-    def create_collection(self) -> chromadb.Collection:
-        """A method to create a collection of articles and figures from a given
-        directory of saved RadioGraphics articles in the format of HTML files."""
+    def _load_corpus(self):
+        """An internal method to load the articles and figures of `data_dir` (kept in
+        `self.article_list` and `self.fig_list`) and the fingerprint of the corpus."""
 
-        # Retrieving articles and figures
+        # Retrieving articles and figures, and removing the boilerplate (e.g., the
+        # references) from the articles, which is recorded in `self.cleaning_report`
         self.article_list = retrieve_articles(self.data_dir)
         self.fig_list = retrieve_figures(self.data_dir)
+        self.cleaning_report = list()
+        if configs.CLEAN_ARTICLES:
+            self.article_list, self.cleaning_report = clean_articles(self.article_list)
         if self.selected_articles is not None:
             self.article_list = [
                 article
                 for article in self.article_list
                 if article["article_file_name"] in self.selected_articles
             ]
+            self.cleaning_report = [
+                item
+                for item in self.cleaning_report
+                if item["article_file_name"] in self.selected_articles
+            ]
             self.fig_list = [
                 fig
                 for fig in self.fig_list
                 if fig["article_file_name"] in self.selected_articles
             ]
 
+        self.fingerprint = self._get_fingerprint()
+
+    def _get_fingerprint(self) -> str:
+        """An internal method to get the fingerprint of the corpus of `data_dir` from
+        its files, without parsing them (see `corpus_fingerprint`)."""
+
+        cleaning = None
+        if configs.CLEAN_ARTICLES:
+            cleaning = [
+                configs.CLEANING_EXCLUDED_SECTIONS,
+                configs.CLEANING_EXCLUDED_PATTERNS,
+                configs.CLEANING_MIN_DUPLICATE_ARTICLES,
+            ]
+        return corpus_fingerprint(
+            self.data_dir,
+            self.selected_articles,
+            self.chunk_size,
+            self.chunk_overlap,
+            embedding_signature(self.embed_fn),
+            cleaning,
+        )
+
+    def create_collection(self) -> chromadb.Collection:
+        """A method to create a collection of figure captions, and a collection of
+        chunks for each article (kept in `self.article_collections`), from a given
+        directory of saved RadioGraphics articles in the format of HTML files. As each
+        article has its own collection, retrieving the context of a figure only searches
+        the chunks of its article, however large the library is. A BM25 index of the
+        chunks of each article is kept in `self.article_indexes` as well."""
+
+        self._load_corpus()
+        self._index_figure_mentions()
+
+        # Grouping the panels of each figure (e.g., Figure 2a and 2b), whose captions
+        # only differ in their labels, so that each caption is embedded once
+        caption_groups = dict()
+        for item in self.fig_list:
+            key = (item["article_file_name"], get_caption_body(item["caption_text"]))
+            caption_groups.setdefault(key, list()).append(item)
+        caption_groups = list(caption_groups.values())
+
         # Building the collection
         if self.collection_name is None:
             now = datetime.datetime.now()
@@ -78,16 +227,53 @@ class Generator:
         collection = client.get_or_create_collection(
             name=collection_name,
             metadata={"hnsw:space": "cosine"},
-            embedding_function=self.embed_fn,
+            embedding_function=self._coalesced_embed_fn,
         )
 
-        # Adding chunked articles' text to the collection
+        # Adding chunked articles' text to the collections of the articles, with the
+        # titles of the sections of the chunks
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
         )
+        article_chunks, article_section_titles = dict(), dict()
         for article in self.article_list:
-            chunks = text_splitter.split_text(article["article_full_text"])
-            collection.add(
+            chunks, section_titles = split_article(article, text_splitter)
+            article_chunks[article["article_file_name"]] = chunks
+            article_section_titles[article["article_file_name"]] = section_titles
+
+        # Fitting a local embedding function on the corpus, or reusing the one saved
+        # with the collection
+        if hasattr(self.embed_fn, "fit"):
+            embedding_path = os.path.join(
+                configs.VECTOR_DB_DIR, f"{collection_name}_embedding.npz"
+            )
+            if os.path.exists(embedding_path):
+                self.embed_fn.load(embedding_path)
+            else:
+                self.embed_fn.fit(
+                    [chunk for chunks in article_chunks.values() for chunk in chunks]
+                    + [group[0]["caption_text"] for group in caption_groups]
+                )
+                os.makedirs(configs.VECTOR_DB_DIR, exist_ok=True)
+                self.embed_fn.save(embedding_path)
+
+        self.article_collections = dict()
+        self.article_indexes = dict()
+        for article in self.article_list:
+            article_collection = client.get_or_create_collection(
+                name=self._get_article_collection_name(
+                    collection_name, article["article_file_name"]
+                ),
+                metadata={"hnsw:space": "cosine"},
+                embedding_function=self._coalesced_embed_fn,
+            )
+            self.article_collections[article["article_file_name"]] = article_collection
+            chunks = article_chunks[article["article_file_name"]]
+            section_titles = article_section_titles[article["article_file_name"]]
+            self.article_indexes[article["article_file_name"]] = BM25Index(chunks)
+            if not chunks:
+                continue
+            article_collection.add(
                 documents=chunks,
                 metadatas=[
                     {
@@ -95,107 +281,210 @@ class Generator:
                         "article_path": article["article_file_path"],
                         "article_name": article["article_file_name"],
                         "chunk_index": i,
+                        "section_title": section_titles[i],
                     }
                     for i in range(len(chunks))
                 ],
                 ids=[f"{article['article_file_name']}_{i}" for i in range(len(chunks))],
             )
 
-        # Adding figure captions to the collection
-        figure_names = [item["figure_name"] for item in self.fig_list]
-        figure_captions = [item["caption_text"] for item in self.fig_list]
-        figure_paths = [item["figure_path"] for item in self.fig_list]
-        figure_article_names = [item["article_file_name"] for item in self.fig_list]
+        # Adding each distinct figure caption to the caption collection, with the
+        # names and paths of all its panels (as JSON lists)
         metadatas = [
             {
                 "type": "figure_caption",
-                "figure_path": figure_paths[i],
-                "article_name": figure_article_names[i],
-                "figure_names": figure_names[i],
+                "figure_path": group[0]["figure_path"],
+                "article_name": group[0]["article_file_name"],
+                "figure_names": json.dumps([item["figure_name"] for item in group]),
+                "figure_paths": json.dumps([item["figure_path"] for item in group]),
             }
-            for i in range(len(self.fig_list))
+            for group in caption_groups
         ]
         collection.add(
-            documents=figure_captions,
+            documents=[group[0]["caption_text"] for group in caption_groups],
             metadatas=metadatas,
             ids=[
-                f"{item['article_file_name']}_{item['figure_name']}"
-                for item in self.fig_list
+                f"{group[0]['article_file_name']}_{group[0]['figure_name']}"
+                for group in caption_groups
             ],
         )
         print(f'The collection "{collection_name}" has been created with:')
         print(
-            f"    {len(self.fig_list)} figures from {len(self.article_list)} articles"
+            f"    {len(self.fig_list)} figures ({len(caption_groups)} distinct captions)"
+            f" from {len(self.article_list)} articles"
         )
+        if self.cleaning_report:
+            removed_bytes = sum(item["removed_bytes"] for item in self.cleaning_report)
+            removed_tokens = sum(
+                item["removed_tokens"] for item in self.cleaning_report
+            )
+            print(
+                f"    ({removed_bytes} bytes, ~{removed_tokens} tokens of boilerplate removed)"
+            )
         return collection
 
-    def _weighted_sampler(self, distances: list) -> iter:
-        """An internal method to generate a weighted sampler based on the distances of the
-        figure caption and the user-specified topic of interest."""
+    def export_snapshot(
+        self, snapshot_dir: str, precisions: list[str] = (configs.SNAPSHOT_PRECISION,)
+    ):
+        """A method to save the collections as a read-only snapshot that loads with a
+        few memory-mapped files, e.g., to share one copy of the embeddings between the
+        worker processes of the demo. Besides the full-precision embeddings, only the
+        quantized ones of the given `precisions` are saved (see `write_snapshot`). The
+        snapshot is written to a staging directory and then published at
+        `snapshot_dir` atomically (see `publish_snapshot`)."""
 
-        # Calculate weights: smaller distances are more likely to be chosen
-        weights = [1 / (d + 1e-6) ** 50 for d in distances]
+        staging_dir = staging_snapshot_dir(snapshot_dir)
+        include = ["documents", "metadatas", "embeddings"]
+        write_snapshot(
+            staging_dir,
+            self.fingerprint,
+            self.collection.get(include=include),
+            {
+                article_name: collection.get(include=include)
+                for article_name, collection in self.article_collections.items()
+            },
+            [
+                {
+                    key: value
+                    for key, value in article.items()
+                    if key != "article_full_text"
+                }
+                for article in self.article_list
+            ],
+            precisions,
+        )
+        # A local embedding is needed to embed the queries like the collections
+        if hasattr(self.embed_fn, "save"):
+            self.embed_fn.save(os.path.join(staging_dir, EMBEDDING_FILE_NAME))
+        publish_snapshot(staging_dir, snapshot_dir)
 
-        # Normalizing weights
-        total_weight = sum(weights)
-        normalized_weights = [w / total_weight for w in weights]
+    def _open_snapshot(self, snapshot_dir: str, precision: str) -> SnapshotCollection:
+        """An internal method to open the snapshot saved in `snapshot_dir` if it was
+        built from the corpus of `data_dir`, or else to build the collections and
+        export them there. The articles are only parsed if the snapshot is missing or
+        stale."""
 
-        while True:
-            # Randomly selecting an index based on weights
-            selected_index = random.choices(
-                range(len(distances)), weights=normalized_weights
-            )[0]
-            yield selected_index
-
-    def _random_sampler(self, captions) -> iter:
-        """An intenral method to generate a random sampler."""
-        indices = list(range(len(captions)))
-        random.shuffle(indices)
-        for index in indices:
-            yield index
-
-    def setup_qbank(
+        if os.path.exists(os.path.join(snapshot_dir, COLUMNS_FILE_NAME)):
+            try:
+                return self.load_snapshot(
+                    snapshot_dir, precision, fingerprint=self._get_fingerprint()
+                )
+            except StaleSnapshotError as error:
+                print(
+                    f'The snapshot "{snapshot_dir}" is stale ({error}) and is rebuilt.'
+                )
+        self.collection = self.create_collection()
+        self.export_snapshot(snapshot_dir, [precision])
+        return self.collection
+
+    def load_snapshot(
         self,
-        topic: str = None,
-    ) -> tuple[list[str], list[str], list[str], iter]:
-        """A method to set up the question bank depending on the user-specified topic."""
+        snapshot_dir: str,
+        precision: str = configs.SNAPSHOT_PRECISION,
+        rescore_factor: int = configs.SNAPSHOT_RESCORE_FACTOR,
+        fingerprint: str = None,
+    ) -> SnapshotCollection:
+        """A method to open the collections from a snapshot saved by `export_snapshot`
+        (the fingerprint of its corpus is kept in `self.fingerprint`). With a "float16"
+        or "int8" `precision`, the quantized embeddings are searched and the best
+        candidates are re-scored at full precision (see `read_snapshot`). A
+        StaleSnapshotError is raised if a `fingerprint` is given and differs."""
+
+        # Resolving the published snapshot once, in case it is replaced meanwhile
+        published_dir = os.path.realpath(snapshot_dir)
+        (
+            self.fingerprint,
+            collection,
+            self.article_collections,
+            self.article_list,
+        ) = read_snapshot(
+            published_dir,
+            self._coalesced_embed_fn,
+            precision,
+            rescore_factor,
+            fingerprint,
+        )
+        if hasattr(self.embed_fn, "load"):
+            self.embed_fn.load(os.path.join(published_dir, EMBEDDING_FILE_NAME))
+        self.article_indexes = {
+            article_name: BM25Index(article_collection.documents)
+            for article_name, article_collection in self.article_collections.items()
+        }
+        self._index_figure_mentions()
+        out = collection.get()
+        self.fig_list = [
+            {
+                "figure_name": figure_name,
+                "figure_path": figure_path,
+                "caption_text": caption,
+                "article_file_name": metadata["article_name"],
+            }
+            for metadata, document in zip(out["metadatas"], out["documents"])
+            for figure_name, figure_path, caption in get_panels(document, metadata)
+        ]
+        print(f'The snapshot "{snapshot_dir}" has been opened with:')
+        print(
+            f"    {len(self.fig_list)} figures ({collection.count()} distinct captions)"
+            f" from {len(self.article_list)} articles"
+        )
+        return collection
+
+    def _index_figure_mentions(self):
+        """An internal method to keep the paragraphs of each article and the indices of
+        the paragraphs that reference each of its figures (see `retrieve_articles`)."""
+
+        self.article_paragraphs = {
+            article["article_file_name"]: article["paragraphs"]
+            for article in self.article_list
+        }
+        self.figure_mentions = {
+            article["article_file_name"]: article["figure_mentions"]
+            for article in self.article_list
+        }
+
+    @staticmethod
+    def _get_article_collection_name(collection_name: str, article_name: str) -> str:
+        """An internal method to name the collection of an article's chunks (article
+        names are too long and free-form to be used in collection names)."""
+
+        digest = hashlib.sha1(article_name.encode()).hexdigest()[:16]
+        # Chroma names have at most 63 characters, so a long collection name is cut
+        # and hashed with the article name to keep the names distinct
+        max_prefix_length = 63 - len(digest) - 1
+        if len(collection_name) > max_prefix_length:
+            name = f"{collection_name}/{article_name}"
+            digest = hashlib.sha1(name.encode()).hexdigest()[:16]
+            collection_name = collection_name[:max_prefix_length]
+        return f"{collection_name}_{digest}"
+
+    def _coalesced_embed_fn(self, texts: list[str]) -> list[list[float]]:
+        """An internal method to embed texts, sharing the embeddings of identical
+        concurrent requests."""
+
+        return self.single_flight.do(
+            ("embed", tuple(texts)), lambda: self.embed_fn(texts)
+        )
+
+    def setup_qbank(self, topic: str = None) -> QBank:
+        """A method to set up the question bank depending on the user-specified topic.
+        The panels of a figure share the distance of their caption to the topic."""
 
         if topic is not None:
-            out = self.collection.query(
-                query_texts=topic,
-                n_results=len(self.fig_list),
-                where={"type": "figure_caption"},
+            # Identical concurrent topic queries share one query
+            out = self.single_flight.do(
+                ("topic", topic),
+                lambda: self.collection.query(
+                    query_texts=topic, n_results=self.collection.count()
+                ),
             )
-            captions = out["documents"][0]
-            article_names = [
-                out["metadatas"][0][i]["article_name"] for i in range(len(captions))
-            ]
-            figure_paths = [
-                out["metadatas"][0][i]["figure_path"] for i in range(len(captions))
-            ]
-            distances = out["distances"][0]
-            sampler = self._weighted_sampler(distances)
-        else:
-            out = self.collection.get(
-                where={"type": "figure_caption"},
+            return QBank.from_entries(
+                out["documents"][0], out["metadatas"][0], out["distances"][0]
             )
-            captions = out["documents"]
-            article_names = [
-                out["metadatas"][i]["article_name"] for i in range(len(captions))
-            ]
-            figure_paths = [
-                out["metadatas"][i]["figure_path"] for i in range(len(captions))
-            ]
-            sampler = self._random_sampler(captions)
-
-        return article_names, figure_paths, captions, sampler
+        return QBank.from_collection(self.collection)
 
     def select_figure(
         self,
-        article_names: list[str],
-        figure_paths: list[str],
-        captions: list[str],
-        sampler: iter,
+        qbank: QBank,
         max_q_per_fig: int = 1,
         reset_memory=False,
     ) -> tuple[str, str, str]:
@@ -204,16 +493,99 @@ class Generator:
         if reset_memory:
             self.generator_memory = dict()
         while True:
-            selected_idx = next(sampler)
+            selected_idx = next(qbank.sampler)
             current_q_count = self.generator_memory.get(selected_idx, 0)
             if current_q_count < max_q_per_fig:
                 self.generator_memory[selected_idx] = current_q_count + 1
                 break
-        selected_article_name = article_names[selected_idx]
-        selected_figpath = figure_paths[selected_idx]
-        selected_caption = captions[selected_idx]
 
-        return selected_article_name, selected_figpath, selected_caption
+        return qbank.get(selected_idx)
+
+    def _retrieve_context(
+        self, article_name: str, caption: str, retrieval_mode: str = "vector"
+    ) -> str:
+        """An internal method to build the context of a figure from the chunks of its
+        article that are closest to its caption, found by the given retrieval mode.
+        The panels of a figure share one context, queried with their caption without
+        its label, and identical concurrent retrievals share one query. If the figure
+        is referenced in the text of its article, the context is made of the paragraphs
+        that reference it instead (without any query)."""
+
+        caption_body = get_caption_body(caption)
+        key = ("context", article_name, caption_body, retrieval_mode)
+        with tracing.span(
+            "retrieval", article_name=article_name, mode=retrieval_mode
+        ) as attrs:
+            context = self.context_cache.get(key)
+            attrs["cached"] = context is not None
+            if context is None and self.use_figure_mentions:
+                context = self._get_mentioned_context(article_name, caption)
+                attrs["mentions"] = context is not None
+            if context is None:
+                context = self.single_flight.do(
+                    key,
+                    lambda: self._query_context(
+                        article_name, caption_body, retrieval_mode
+                    ),
+                )
+            self.context_cache[key] = context
+        return context
+
+    def _get_mentioned_context(self, article_name: str, caption: str) -> str:
+        """An internal method to build the context of a figure from the paragraphs of
+        its article that reference it, in their order in the article and up to the
+        length of the retrieved chunks. Returns None if no paragraph references it."""
+
+        match = re.match(r"Figure (\d+)", caption)
+        if match is None:
+            return None
+        paragraph_indices = self.figure_mentions[article_name].get(int(match.group(1)))
+        if not paragraph_indices:
+            return None
+
+        max_length = self.num_retrieved_chunks * self.chunk_size
+        paragraphs, length = list(), 0
+        for i in paragraph_indices:
+            paragraph = self.article_paragraphs[article_name][i]
+            if paragraphs and length + len(paragraph) > max_length:
+                break
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+        context = "..." + "...".join(paragraphs) + "..."
+
+        return context
+
+    def _query_context(
+        self, article_name: str, caption: str, retrieval_mode: str
+    ) -> str:
+        """An internal method to query the chunks of the context of a figure (empty if
+        none is found, see `rank_chunks`)."""
+
+        index = self.article_indexes[article_name]
+        num_chunks = len(index.documents)
+        if num_chunks == 0:
+            return ""
+        num_candidates = self.num_retrieved_chunks
+        if retrieval_mode == "hybrid":
+            num_candidates = max(num_candidates, configs.HYBRID_NUM_CANDIDATES)
+        num_candidates = min(num_candidates, num_chunks)
+
+        ranking = rank_chunks(
+            caption,
+            index,
+            self.article_collections[article_name],
+            retrieval_mode,
+            num_candidates,
+        )
+        if not ranking:
+            return ""
+
+        # Joining the retrieved chunks in their order in the article
+        chunk_indices = sorted(ranking[: self.num_retrieved_chunks])
+        chunks = [index.documents[i] for i in chunk_indices]
+        context = "..." + "...".join(chunks) + "..."
+
+        return context
 
     def generate_qa(
         self,
@@ -223,46 +595,62 @@ class Generator:
         caption: str,
         type_of_question: str,
         complete_return: bool = False,
+        on_event: callable = None,
+        cancel_token: CancellationToken = None,
+        retrieval_mode: str = None,
+        **qa_kwargs,
     ) -> Union[dict, tuple[dict, str]]:
-        """A method to generate a question-answer pair from a given figure caption."""
+        """A method to generate a question-answer pair from a given figure caption. Any
+        extra keyword arguments (e.g., a `checkpoint` dictionary, or `num_questions` to
+        get a list of question-answer pairs from one call) are passed to `qa_fn`.
+        If `on_event` is given, it is notified of the retrieval stage and passed on to
+        `qa_fn` to receive the progress events of the LLM stages. If a `cancel_token` is
+        given, it is checked before the retrieval and passed on to `qa_fn`, which stops
+        before its next stage once the token is cancelled (raising CancelledError).
+        The `retrieval_mode` ("vector", "lexical", or "hybrid") of the context defaults
+        to the one of the generator.
+        """
 
-        # Retrieving the closest chunks to the caption
-        out = self.collection.query(
-            query_texts=caption,
-            n_results=self.num_retrieved_chunks,
-            where={"$and": [{"type": "article"}, {"article_name": article_name}]},
-        )
+        if cancel_token is not None:
+            cancel_token.check()
+            qa_kwargs["cancel_token"] = cancel_token
+        if on_event is not None:
+            on_event({"event": "stage", "stage": "retrieval"})
+            qa_kwargs["on_event"] = on_event
 
-        # Finding the figure number
-        fignum = figpath.split("/")[-1].split(".")[-2]
-
-        # Building the context from the retrieved chunks
-        chunks = out["documents"][0]
-        metadata = out["metadatas"][0]
-        chunk_indices = [metadata[i]["chunk_index"] for i in range(len(metadata))]
-        chunks_copy = chunks.copy()
-        chunks.sort(key=lambda x: chunk_indices[chunks_copy.index(x)])
-        metadata_copy = metadata.copy()
-        metadata.sort(key=lambda x: chunk_indices[metadata_copy.index(x)])
-        context = "..." + "...".join(chunks) + "..."
+        with tracing.span("generate_qa", type_of_question=type_of_question) as attrs:
+            # Finding the figure number
+            fignum = figpath.split("/")[-1].split(".")[-2]
 
-        # Generating the question and answer
-        (
-            qa_dict,
-            llm1_response,
-            llm2_response,
-            llm3_response,
-            total_tokens,
-            total_price,
-        ) = qa_fn(
-            fignum,
-            caption,
-            context,
-            type_of_question,
-            self.generator_model,
-            self.content_editor_model,
-            self.format_editor_model,
+            # Building the context from the closest chunks to the caption
+            context = self._retrieve_context(
+                article_name, caption, retrieval_mode or self.retrieval_mode
+            )
+
+            # Generating the question and answer
+            (
+                qa_dict,
+                llm1_response,
+                llm2_response,
+                llm3_response,
+                total_tokens,
+                total_price,
+            ) = qa_fn(
+                fignum,
+                caption,
+                context,
+                type_of_question,
+                self.generator_model,
+                self.content_editor_model,
+                self.format_editor_model,
+                **qa_kwargs,
+            )
+            attrs.update(total_tokens=total_tokens, total_price=total_price)
+        num_questions = len(qa_dict) if isinstance(qa_dict, list) else 1
+        tracing.increment(
+            "questions_generated_total", num_questions, type=type_of_question
         )
+
         if complete_return:
             return (
                 qa_dict,
@@ -274,3 +662,51 @@ class Generator:
                 total_price,
             )
         return qa_dict
+
+    def generate_qa_stream(
+        self,
+        qa_fn: callable,
+        article_name: str,
+        figpath: str,
+        caption: str,
+        type_of_question: str,
+        **qa_kwargs,
+    ) -> iter:
+        """A method to generate a question-answer pair while yielding the progress
+        events of the pipeline (see `generate_qa`) as they happen. The last yielded
+        event is {"event": "result", "result": ...}, where the result is the complete
+        return of `generate_qa`. If the consumer stops iterating (e.g., the generator is
+        closed because the user left), the generation is cancelled."""
+
+        events = queue.Queue()
+        cancel_token = qa_kwargs.pop("cancel_token", None) or CancellationToken()
+
+        def target():
+            try:
+                result = self.generate_qa(
+                    qa_fn,
+                    article_name,
+                    figpath,
+                    caption,
+                    type_of_question,
+                    complete_return=True,
+                    on_event=events.put,
+                    cancel_token=cancel_token,
+                    **qa_kwargs,
+                )
+                events.put({"event": "result", "result": result})
+            except Exception as error:
+                events.put({"event": "error", "error": error})
+
+        threading.Thread(target=target, daemon=True).start()
+        finished = False
+        try:
+            while not finished:
+                event = events.get()
+                if event["event"] == "error":
+                    raise event["error"]
+                finished = event["event"] == "result"
+                yield event
+        finally:
+            if not finished:
+                cancel_token.cancel()
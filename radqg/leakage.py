@@ -0,0 +1,208 @@
+##########################################################################################
+# Description: A script containing a local checker for caption leakage into questions.
+##########################################################################################
+
+import re
+import threading
+
+# ----------------------------------------------------------------------------------------
+# Configurations
+
+FIGURE_REFERENCE_PATTERN = re.compile(r"\b(?:Figure|Figs?\.?)\s*\d+[a-z]?\b", re.I)
+CAPTION_LABEL_PATTERN = re.compile(r"^\s*Figure \d+[a-z]?\.?\s*")
+PANEL_MARKER_PATTERN = re.compile(r"\((?:[a-z](?:[,–\- ]+[a-z])*)\)")
+FINDINGS_VERB_PATTERN = re.compile(
+    r"\b(?:shows?|showed|demonstrates?|demonstrated|reveals?|revealed|depicts?|"
+    r"depicted|illustrates?|illustrated|confirms?|confirmed)\b",
+    re.I,
+)
+HISTORY_PATTERN = re.compile(r"\bin an? \d+[- ]year[- ]old\b", re.I)
+OPTIONS_PATTERN = re.compile(r"(?:^|\s|\\n)\(?A\)")
+QUESTION_VALUE_PATTERN = re.compile(
+    r"""['"]question['"]\s*:\s*(['"])(.*?)\1\s*(?:,|\})""", re.S
+)
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+STOPWORDS = set(
+    """
+    a an and are as at be by for from has have in into is it its of on or that the
+    their there these this to was were which with who within image images ct mri mr
+    axial coronal sagittal arrow arrows arrowhead arrowheads intravenous
+    contrast-enhanced nonenhanced unenhanced patient figure note also both
+    """.split()
+)
+
+_stats_lock = threading.Lock()
+_stats = {"checked": 0, "clean": 0, "skipped": 0}
+
+# ----------------------------------------------------------------------------------------
+# extract_question_text
+
+
+def extract_question_text(qa_dict_string: str) -> str:
+    """A function to extract the stem of the question from a raw question-answer
+    dictionary string returned by the generator LLM, dropping any MCQ options."""
+
+    match = QUESTION_VALUE_PATTERN.search(qa_dict_string)
+    if match:
+        question = match.group(2)
+    else:
+        # Falling back to everything before the answer key
+        question = re.split(r"""['"]answer['"]\s*:""", qa_dict_string)[0]
+
+    # The options naturally mention the diagnosis, so they are not checked
+    return OPTIONS_PATTERN.split(question, maxsplit=1)[0]
+
+
+# ----------------------------------------------------------------------------------------
+# split_qa_dict_strings
+
+
+def split_qa_dict_strings(qa_list_string: str) -> list[str]:
+    """A function to split a raw string holding a list of question-answer dictionaries
+    into the strings of the individual dictionaries, by matching their outer braces
+    (braces within quoted values are ignored)."""
+
+    items, depth, start, quote = list(), 0, None, None
+    for i, char in enumerate(qa_list_string):
+        if quote is not None:
+            if char == quote and qa_list_string[i - 1] != "\\":
+                quote = None
+        elif char in "'\"" and depth > 0:
+            # Apostrophes within words (e.g., Crohn's) do not open a quoted value
+            if not (char == "'" and qa_list_string[i - 1 : i].isalnum()):
+                quote = char
+        elif char == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                items.append(qa_list_string[start : i + 1])
+    return items
+
+
+# ----------------------------------------------------------------------------------------
+# _content_ngrams
+
+
+def _content_ngrams(text: str, n: int = 2) -> set[tuple[str, ...]]:
+    """An internal function to build the n-grams of the consecutive content words in
+    a given text."""
+
+    ngrams = set()
+    for fragment in re.split(r"[.;:,()]", text.lower()):
+        words = [w for w in WORD_PATTERN.findall(fragment) if w not in STOPWORDS]
+        for i in range(len(words) - n + 1):
+            ngrams.add(tuple(words[i : i + n]))
+    return ngrams
+
+
+# ----------------------------------------------------------------------------------------
+# _caption_phrases
+
+
+def _caption_phrases(caption: str) -> tuple[str, str, str]:
+    """An internal function to split a figure caption into its diagnosis, clinical
+    history, and imaging findings segments."""
+
+    caption = CAPTION_LABEL_PATTERN.sub("", caption)
+    caption = PANEL_MARKER_PATTERN.sub(" ", caption)
+    sentences = re.split(r"(?<=[a-z0-9)])\.\s*(?=[A-Z(])", caption)
+
+    # The first sentence usually reads "<diagnosis> in a <age>-year-old <history>"
+    first = sentences[0] if sentences else ""
+    history_match = HISTORY_PATTERN.search(first)
+    if history_match:
+        diagnosis = first[: history_match.start()]
+        history = first[history_match.start() :]
+    else:
+        diagnosis, history = first, ""
+
+    # The imaging findings follow verbs such as "show" or "demonstrate"
+    findings = []
+    for sentence in sentences:
+        parts = FINDINGS_VERB_PATTERN.split(sentence, maxsplit=1)
+        if len(parts) == 2:
+            findings.append(parts[1])
+    return diagnosis, history, " ".join(findings)
+
+
+# ----------------------------------------------------------------------------------------
+# check_leakage
+
+
+def check_leakage(
+    qa_dict_string: str,
+    caption: str,
+    type_of_question: str,
+    strictness: float = 0.9,
+) -> dict:
+    """A function to locally score whether a generated question discloses the figure
+    number, diagnosis, or imaging findings of its figure caption. Any overlap with the
+    diagnosis is flagged, while a higher strictness (between 0 and 1) tolerates less
+    overlap with the imaging findings before flagging the question."""
+
+    question = extract_question_text(qa_dict_string)
+    question_ngrams = _content_ngrams(question)
+    diagnosis, history, findings = _caption_phrases(caption)
+
+    # The clinical history may legitimately be reused in the stem of the question
+    history_ngrams = _content_ngrams(history)
+    diagnosis_ngrams = _content_ngrams(diagnosis) - history_ngrams
+    findings_ngrams = _content_ngrams(findings) - history_ngrams
+    leak_ngrams = diagnosis_ngrams | findings_ngrams
+    matched = question_ngrams & leak_ngrams
+    overlap = len(matched) / len(leak_ngrams) if leak_ngrams else 0.0
+
+    figure_reference = bool(FIGURE_REFERENCE_PATTERN.search(question))
+    diagnosis_leaked = bool(question_ngrams & diagnosis_ngrams)
+    missing_options = type_of_question == "MCQ" and not all(
+        re.search(rf"\b{letter}\)", qa_dict_string) for letter in "ABCDE"
+    )
+    leaked = (
+        figure_reference
+        or diagnosis_leaked
+        or missing_options
+        or (bool(matched) and overlap >= 1.0 - strictness)
+    )
+
+    return {
+        "leaked": leaked,
+        "overlap": overlap,
+        "figure_reference": figure_reference,
+        "diagnosis_leaked": diagnosis_leaked,
+        "missing_options": missing_options,
+        "matched_phrases": sorted(" ".join(ngram) for ngram in matched),
+    }
+
+
+# ----------------------------------------------------------------------------------------
+# record_leakage_check
+
+
+def record_leakage_check(leaked: bool, skipped: bool):
+    """A function to record the outcome of a leakage check for skip-rate reporting."""
+
+    with _stats_lock:
+        _stats["checked"] += 1
+        _stats["clean"] += int(not leaked)
+        _stats["skipped"] += int(skipped)
+
+
+# ----------------------------------------------------------------------------------------
+# get_leakage_stats
+
+
+def get_leakage_stats(reset: bool = False) -> dict:
+    """A function to get the number of checked, clean, and skipped content edits along
+    with the clean rate (i.e., the achievable skip rate)."""
+
+    with _stats_lock:
+        stats = dict(_stats)
+        if reset:
+            for key in _stats:
+                _stats[key] = 0
+    stats["clean_rate"] = stats["clean"] / stats["checked"] if stats["checked"] else 0.0
+    return stats
@@ -0,0 +1,96 @@
+##########################################################################################
+# Description: A script containing the HTTP backend of the OpenAI-compatible APIs.
+##########################################################################################
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ----------------------------------------------------------------------------------------
+# KeepAliveSession
+
+
+class KeepAliveSession(requests.Session):
+    """A class for an HTTP session whose connections stay open when the OpenAI SDK
+    closes it: the SDK (0.27) closes the session of each thread every few minutes
+    (`openai.api_requestor.MAX_SESSION_LIFETIME_SECS`) and then reuses the installed
+    session, which would drop the keep-alive pool shared by all the threads. The
+    connections are only closed by `close_pool`."""
+
+    def close(self):
+        pass
+
+    def close_pool(self):
+        """A method to close the pooled connections of the session."""
+
+        super().close()
+
+
+# ----------------------------------------------------------------------------------------
+# create_session
+
+
+def create_session(pool_size: int = 20) -> KeepAliveSession:
+    """A function to create an HTTP session that keeps up to `pool_size` connections
+    alive for each host. Failed requests are not retried by the session, since they are
+    retried by the governor."""
+
+    session = KeepAliveSession()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# ----------------------------------------------------------------------------------------
+# Backend
+
+
+class Backend:
+    """A class for an OpenAI-compatible API endpoint, i.e., the OpenAI API or a local
+    inference server or gateway, whose requests share a pooled keep-alive session.
+    The OpenAI SDK (0.27) cannot be given a session per request: the session is used
+    by every request of the process once installed as `openai.requestssession`, so
+    the backends of a process should share one session (only the base URL, key, and
+    timeouts are set per backend, see `get_request_kwargs`)."""
+
+    def __init__(
+        self,
+        base_url: str = None,
+        api_key: str = None,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        session: requests.Session = None,
+        pool_size: int = 20,
+    ):
+        """The constructor of the Backend class. If `base_url` is None, the OpenAI API is
+        used. If no `session` is given, a new one is created with `pool_size`
+        connections per host."""
+
+        self.base_url = base_url.rstrip("/") if base_url else None
+        # Local servers usually accept any key, but the OpenAI SDK requires one
+        self.api_key = api_key if api_key or base_url is None else "EMPTY"
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = session if session is not None else create_session(pool_size)
+
+    def get_request_kwargs(self) -> dict:
+        """A method to get the keyword arguments that direct an OpenAI SDK request to
+        this backend."""
+
+        kwargs = {
+            "api_key": self.api_key,
+            "request_timeout": (self.connect_timeout, self.read_timeout),
+        }
+        if self.base_url is not None:
+            kwargs["api_base"] = self.base_url
+        return kwargs
+
+    def close(self):
+        """A method to close the pooled connections of the backend."""
+
+        if isinstance(self.session, KeepAliveSession):
+            self.session.close_pool()
+        else:
+            self.session.close()
@@ -0,0 +1,264 @@
+##########################################################################################
+# Description: A script containing a client-side governor for rate-limited LLM APIs.
+##########################################################################################
+
+import random
+import threading
+import time
+import radqg.tracing as tracing
+
+# ----------------------------------------------------------------------------------------
+# CircuitOpenError
+
+
+class CircuitOpenError(RuntimeError):
+    """An exception raised when a call is rejected because the circuit is open."""
+
+
+# ----------------------------------------------------------------------------------------
+# TokenBucket
+
+
+class TokenBucket:
+    """A thread-safe token bucket. Callers reserve tokens up front and wait for the
+    bucket to pay back its debt, so concurrent callers are served in order."""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        """The constructor of the TokenBucket class."""
+
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """A method to take tokens from the bucket, blocking until they are available.
+        Returns the number of seconds waited."""
+
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(
+                self.capacity, self._tokens + elapsed * self.refill_per_second
+            )
+            self._updated = now
+            self._tokens -= amount
+            wait = max(0.0, -self._tokens / self.refill_per_second)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+# ----------------------------------------------------------------------------------------
+# CircuitBreaker
+
+
+class CircuitBreaker:
+    """A circuit breaker that opens after a number of consecutive failures and lets a
+    single trial call through once the reset timeout has passed."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        """The constructor of the CircuitBreaker class."""
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """A method to check whether a call is allowed; raises CircuitOpenError if not."""
+
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                if time.monotonic() - self._opened_at >= self.reset_timeout:
+                    self.state = "half-open"
+                    return
+            raise CircuitOpenError(
+                f"The circuit is {self.state}; failing fast after "
+                f"{self._failures} consecutive failures."
+            )
+
+    def is_open(self) -> bool:
+        """A method to check whether calls are currently rejected."""
+
+        with self._lock:
+            return (
+                self.state == "open"
+                and time.monotonic() - self._opened_at < self.reset_timeout
+            )
+
+    def record_success(self):
+        """A method to record a call that reached the service."""
+
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_neutral(self):
+        """A method to record a call that neither succeeded nor failed (e.g., a throttled
+        or rejected call), leaving the failures as they are. The trial call of a
+        half-open circuit is released, so that another one can be let through."""
+
+        with self._lock:
+            if self.state == "half-open":
+                self.state = "open"
+
+    def record_failure(self):
+        """A method to record a failed call."""
+
+        with self._lock:
+            self._failures += 1
+            if self.state == "half-open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+# ----------------------------------------------------------------------------------------
+# Governor
+
+
+class Governor:
+    """A class to govern calls to a rate-limited API with per-model requests-per-minute
+    and tokens-per-minute buckets, jittered exponential backoff that honors the server's
+    retry-after hints, and a per-model circuit breaker. Models without configured limits
+    are not rate limited."""
+
+    def __init__(
+        self,
+        rpm_limits: dict = None,
+        tpm_limits: dict = None,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        """The constructor of the Governor class."""
+
+        self.rpm_limits = rpm_limits or dict()
+        self.tpm_limits = tpm_limits or dict()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._buckets = dict()
+        self._breakers = dict()
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, kind: str, model: str) -> TokenBucket:
+        """An internal method to get (or lazily create) the bucket of a model."""
+
+        limits = self.rpm_limits if kind == "rpm" else self.tpm_limits
+        if model not in limits:
+            return None
+        with self._lock:
+            if (kind, model) not in self._buckets:
+                per_minute = limits[model]
+                self._buckets[(kind, model)] = TokenBucket(per_minute, per_minute / 60)
+            return self._buckets[(kind, model)]
+
+    def get_breaker(self, model: str) -> CircuitBreaker:
+        """A method to get (or lazily create) the circuit breaker of a model."""
+
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self._breakers[model]
+
+    def _get_delay(self, attempt: int, retry_after: float = None) -> float:
+        """An internal method to compute the jittered backoff delay of an attempt."""
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(
+        self,
+        model: str,
+        fn: callable,
+        tokens: int = 0,
+        retryable: tuple = (Exception,),
+        throttled: tuple = (),
+        get_retry_after: callable = None,
+        max_retries: int = None,
+    ):
+        """A method to call `fn` (with no arguments) on behalf of a model. `tokens` is the
+        estimated number of tokens the call consumes from the tokens-per-minute limit.
+        Errors of the `retryable` types are retried with backoff; other errors are
+        raised immediately. Retryable errors of the `throttled` types (e.g., rate limit
+        errors), errors that are not retryable, and interruptions (e.g., a
+        KeyboardInterrupt or a closed stream) are counted by the circuit breaker as
+        neither failures nor successes. `max_retries` overrides the number of retries
+        of the governor for this call.
+
+        >>> governor = Governor(max_retries=0, failure_threshold=1, reset_timeout=0)
+        >>> def fail():
+        ...     raise ConnectionError()
+        >>> def interrupt():
+        ...     raise KeyboardInterrupt()
+        >>> for fn in [fail, interrupt]:
+        ...     try:
+        ...         governor.call("model", fn, retryable=(ConnectionError,))
+        ...     except BaseException as error:
+        ...         print(type(error).__name__, governor.get_breaker("model").state)
+        ConnectionError open
+        KeyboardInterrupt open
+        >>> governor.call("model", lambda: "ok")
+        'ok'
+        """
+
+        if max_retries is None:
+            max_retries = self.max_retries
+        breaker = self.get_breaker(model)
+        for attempt in range(max_retries + 1):
+            try:
+                breaker.before_call()
+            except CircuitOpenError:
+                tracing.increment("api_circuit_open_total", model=model)
+                raise
+            # The trial call of a half-open circuit is released however the call ends
+            recorded = False
+            try:
+                with tracing.span("api_rate_limit_wait", model=model):
+                    for kind, amount in [("rpm", 1), ("tpm", tokens)]:
+                        bucket = self._get_bucket(kind, model)
+                        if bucket is not None and amount > 0:
+                            bucket.acquire(amount)
+                try:
+                    result = fn()
+                except retryable as error:
+                    error_name = type(error).__name__
+                    tracing.increment(
+                        "api_errors_total", model=model, error=error_name
+                    )
+                    if isinstance(error, throttled):
+                        breaker.record_neutral()
+                    else:
+                        breaker.record_failure()
+                    recorded = True
+                    if attempt == max_retries:
+                        raise
+                    retry_after = get_retry_after(error) if get_retry_after else None
+                    delay = self._get_delay(attempt, retry_after)
+                    print(f"{error_name} for {model}; retrying in {delay:.1f}s...")
+                    tracing.increment(
+                        "api_retries_total", model=model, error=error_name
+                    )
+                    time.sleep(delay)
+                    continue
+                breaker.record_success()
+                recorded = True
+                return result
+            finally:
+                if not recorded:
+                    breaker.record_neutral()
@@ -0,0 +1,131 @@
+##########################################################################################
+# Description: A script containing a policy for hedging slow LLM requests.
+##########################################################################################
+
+import collections
+import queue
+import threading
+import time
+import radqg.tracing as tracing
+
+# ----------------------------------------------------------------------------------------
+# HedgingPolicy
+
+
+class HedgingPolicy:
+    """A class for hedging requests: once a request has not started to respond after a
+    percentile of the recent times to first response of its kind, a duplicate request
+    is sent and the first one to respond is used, while the other is cancelled. Only
+    requests that can stop as soon as the other one responds (e.g., streamed LLM calls)
+    should be hedged, since the loser otherwise runs, and is paid for, to completion.
+    At most `max_hedge_ratio` of the requests are hedged to cap the extra spend."""
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        min_samples: int = 20,
+        max_hedge_ratio: float = 0.1,
+        window: int = 200,
+    ):
+        """The constructor of the HedgingPolicy class. No request of a kind is hedged
+        until `min_samples` latencies of that kind are recorded, and only the last
+        `window` latencies are kept."""
+
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.window = window
+        self.num_requests = 0
+        self.num_hedged = 0
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=window)
+        )
+        self._lock = threading.Lock()
+
+    def record_latency(self, key: str, latency: float):
+        """A method to record the time (in seconds) a request of a kind took to start
+        to respond."""
+
+        with self._lock:
+            self._latencies[key].append(latency)
+
+    def get_delay(self, key: str) -> float:
+        """A method to get the seconds after which a request of a kind is hedged, or
+        None if there are not enough recorded latencies yet."""
+
+        with self._lock:
+            latencies = sorted(self._latencies[key])
+        if len(latencies) < self.min_samples:
+            return None
+        index = round((len(latencies) - 1) * self.percentile / 100)
+        return latencies[index]
+
+    def _reserve_hedge(self) -> bool:
+        """An internal method to reserve a hedge within the hedge ratio."""
+
+        with self._lock:
+            if self.num_hedged + 1 > self.max_hedge_ratio * self.num_requests:
+                return False
+            self.num_hedged += 1
+            return True
+
+    def call(self, key: str, fn: callable) -> tuple:
+        """A method to make a request of a kind with `fn(claim)`, hedging it if needed.
+        `fn` must call `claim()` as soon as its response starts to arrive; if `claim()`
+        returns False, the other request has already responded, so `fn` should stop and
+        return. Returns the result of the first request to claim and whether the
+        request was hedged."""
+
+        with self._lock:
+            self.num_requests += 1
+        delay = self.get_delay(key)
+        results = queue.Queue()
+        winner = list()
+        winner_lock = threading.Lock()
+        starts = dict()
+
+        def claim(index: int) -> bool:
+            with winner_lock:
+                if not winner:
+                    winner.append(index)
+                    # The winner is chosen at its first response, so the delay of the
+                    # hedge is taken from the times to first response
+                    self.record_latency(key, time.monotonic() - starts[index])
+                return winner[0] == index
+
+        def run(index: int):
+            starts[index] = time.monotonic()
+            try:
+                result = fn(lambda: claim(index))
+            except Exception as error:
+                results.put((index, None, error))
+                return
+            results.put((index, result, None))
+
+        threading.Thread(target=run, args=(0,), daemon=True).start()
+        num_running, hedged = 1, False
+        try:
+            outcome = results.get(timeout=delay)
+        except queue.Empty:
+            # A duplicate of a request that has already started to respond would lose
+            with winner_lock:
+                responding = bool(winner)
+            if not responding and self._reserve_hedge():
+                tracing.increment("llm_hedges_total", key=key)
+                threading.Thread(target=run, args=(1,), daemon=True).start()
+                num_running, hedged = 2, True
+            outcome = results.get()
+
+        while True:
+            index, result, error = outcome
+            num_running -= 1
+            won = claim(index) if error is None else winner[:1] == [index]
+            if won and error is not None:
+                raise error
+            if won:
+                if index == 1:
+                    tracing.increment("llm_hedge_wins_total", key=key)
+                return result, hedged
+            if num_running == 0:
+                raise error
+            outcome = results.get()
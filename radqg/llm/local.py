@@ -0,0 +1,127 @@
+##########################################################################################
+# Description: A script containing a local embedding function that needs no API calls.
+##########################################################################################
+
+import collections
+import zlib
+import numpy as np
+import radqg.configs as configs
+from radqg.bm25 import tokenize
+
+# ----------------------------------------------------------------------------------------
+# LocalEmbedding
+
+
+class LocalEmbedding:
+    """A class for embedding texts locally with hashed TF-IDF vectors of their words and
+    word bigrams, projected onto their main directions in the corpus (latent semantic
+    analysis). The idf weights and the projection are fitted on the corpus at ingest
+    time and can be saved next to the collection. An instance can be passed to the
+    Generator as its `embed_fn`."""
+
+    def __init__(
+        self,
+        dim: int = configs.LOCAL_EMBEDDING_DIM,
+        num_features: int = configs.LOCAL_EMBEDDING_FEATURES,
+        max_fit_documents: int = configs.LOCAL_EMBEDDING_MAX_FIT_DOCUMENTS,
+        seed: int = configs.LOCAL_EMBEDDING_SEED,
+        batch_size: int = 512,
+    ):
+        """The constructor of the LocalEmbedding class."""
+
+        self.dim = dim
+        self.num_features = num_features
+        self.max_fit_documents = max_fit_documents
+        self.seed = seed
+        self.batch_size = batch_size
+        self.idf = None
+        self.components = None
+
+    def _hash_terms(self, text: str) -> list[int]:
+        """An internal method to hash the words and word bigrams of a text."""
+
+        words = tokenize(text)
+        terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return [zlib.crc32(term.encode()) % self.num_features for term in terms]
+
+    def _tfidf(self, texts: list[str]) -> np.ndarray:
+        """An internal method to build the normalized TF-IDF matrix of a list of texts."""
+
+        matrix = np.zeros((len(texts), self.num_features), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts = collections.Counter(self._hash_terms(text))
+            if counts:
+                indices = np.fromiter(counts.keys(), dtype=np.int64)
+                frequencies = np.fromiter(counts.values(), dtype=np.float32)
+                matrix[i, indices] = 1 + np.log(frequencies)
+        if self.idf is not None:
+            matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _batches(self, texts: list[str]) -> iter:
+        """An internal method to yield the slices and TF-IDF matrices of the batches of
+        a list of texts, so that the whole matrix is never held in memory."""
+
+        for start in range(0, len(texts), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            yield batch, self._tfidf(texts[batch])
+
+    def fit(self, texts: list[str]):
+        """A method to fit the idf weights and the projection on a corpus of texts, with
+        a randomized singular value decomposition of its TF-IDF matrix."""
+
+        rng = np.random.default_rng(self.seed)
+        if len(texts) > self.max_fit_documents:
+            indices = rng.choice(len(texts), self.max_fit_documents, replace=False)
+            texts = [texts[i] for i in sorted(indices)]
+
+        # Fitting the inverse document frequencies of the hashed terms
+        self.idf, self.components = None, None
+        document_frequencies = np.zeros(self.num_features, dtype=np.float32)
+        for text in texts:
+            document_frequencies[list(set(self._hash_terms(text)))] += 1
+        self.idf = np.log((1 + len(texts)) / (1 + document_frequencies)) + 1
+
+        # Finding the range of the TF-IDF matrix (A) with one power iteration
+        rank = min(self.dim + 10, len(texts))
+        omega = rng.standard_normal((self.num_features, rank)).astype(np.float32)
+        y = np.zeros((len(texts), rank), dtype=np.float32)
+        for batch, a in self._batches(texts):
+            y[batch] = a @ omega
+        q, _ = np.linalg.qr(y)
+        z = np.zeros((self.num_features, rank), dtype=np.float32)
+        for batch, a in self._batches(texts):
+            z += a.T @ q[batch]
+        for batch, a in self._batches(texts):
+            y[batch] = a @ z
+        q, _ = np.linalg.qr(y)
+
+        # Projecting A onto its range and decomposing the small projected matrix
+        b = np.zeros((rank, self.num_features), dtype=np.float32)
+        for batch, a in self._batches(texts):
+            b += q[batch].T @ a
+        _, _, vt = np.linalg.svd(b, full_matrices=False)
+        self.components = vt[: self.dim].T.astype(np.float32)
+
+    def save(self, path: str):
+        """A method to save the fitted idf weights and projection to a .npz file."""
+
+        np.savez(path, idf=self.idf, components=self.components)
+
+    def load(self, path: str):
+        """A method to load the idf weights and projection saved in a .npz file."""
+
+        with np.load(path) as data:
+            self.idf = data["idf"]
+            self.components = data["components"]
+        self.num_features = len(self.idf)
+        self.dim = self.components.shape[1]
+
+    def __call__(self, texts: list[str]) -> list[list[float]]:
+        """A method to embed a list of texts into unit vectors."""
+
+        assert self.components is not None, "The local embedding has not been fitted."
+        embeddings = self._tfidf(texts) @ self.components
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return (embeddings / np.maximum(norms, 1e-12)).tolist()
@@ -0,0 +1,241 @@
+##########################################################################################
+# Description: A script containing deterministic mock LLM and embedding functions for
+# running and benchmarking the pipeline offline.
+##########################################################################################
+
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from typing import Union
+import radqg.configs as configs
+from radqg.llm.openai import qa as openai_qa
+
+# ----------------------------------------------------------------------------------------
+# Configurations
+
+# Patterns of the inputs of the prompts of each stage (see `radqg.prompts`)
+GENERATOR_PATTERN = re.compile(
+    r"## String Containing the Figure Number\n\s*(?P<fignum>.*?)\n\s*"
+    r"## Figure Caption\n\s*(?P<caption>.*?)\n\s*## Context",
+    re.S,
+)
+CONTENT_EDITOR_PATTERN = re.compile(
+    r"--- Input ---\s*- Figure Caption: \n\s*(?P<caption>.*?)\n\s*"
+    r"- Question-Answer Pair: \n\s*(?P<qa>.*?)\n\s*"
+    r"- Type of Question:\n\s*(?P<type>\S+)",
+    re.S,
+)
+FORMAT_EDITOR_PATTERN = re.compile(
+    r'Input String: "(?P<qa>.*)"\n\s*--- Further instructions', re.S
+)
+TYPE_PATTERN = re.compile(r"scenario-based (\S+) question")
+NUM_QUESTIONS_PATTERN = re.compile(
+    r"(?:Develop|is a Python list of) (\d+) (?:distinct questions|dictionaries)"
+)
+
+settings = {
+    "embedding_dim": configs.MOCK_EMBEDDING_DIM,
+    "embedding_latency": configs.MOCK_EMBEDDING_LATENCY,
+    "stage_latencies": dict(configs.MOCK_STAGE_LATENCIES),
+    "failure_rates": dict(configs.MOCK_FAILURE_RATES),
+    "leakage_rate": configs.MOCK_LEAKAGE_RATE,
+}
+_rng = random.Random(configs.MOCK_SEED)
+_rng_lock = threading.Lock()
+
+# ----------------------------------------------------------------------------------------
+# configure
+
+
+def configure(seed: int = None, **kwargs):
+    """A function to change the settings of the mock functions (embedding_dim,
+    embedding_latency, stage_latencies, failure_rates, leakage_rate) and optionally
+    reseed their random number generator."""
+
+    for key, value in kwargs.items():
+        assert key in settings, f"Unknown mock setting: {key}"
+        settings[key] = value
+    if seed is not None:
+        with _rng_lock:
+            _rng.seed(seed)
+
+
+# ----------------------------------------------------------------------------------------
+# _count_tokens
+
+
+def _count_tokens(string: str) -> int:
+    """An internal function to approximate the number of tokens in a string without
+    loading a tokenizer."""
+
+    return max(1, len(string) // 4)
+
+
+# ----------------------------------------------------------------------------------------
+# embed_fn
+
+
+def embed_fn(
+    text_list_to_embed: list[str], model: str = configs.OPENAI_EMBEDDING_MODEL
+) -> list[float]:
+    """A function to embed a list of texts with deterministic hashed bag-of-words
+    vectors, so that texts sharing words are close to each other."""
+
+    if settings["embedding_latency"] > 0:
+        time.sleep(settings["embedding_latency"])
+
+    dim = settings["embedding_dim"]
+    embeddings = list()
+    for text in text_list_to_embed:
+        vector = [0.0] * dim
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % dim] += 1.0 if (value >> 32) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        embeddings.append([v / norm for v in vector])
+
+    return embeddings
+
+
+# ----------------------------------------------------------------------------------------
+# _mock_qa_dict
+
+
+def _mock_qa_dict(fignum: str, caption: str, type_of_question: str) -> dict:
+    """An internal function to build a deterministic question-answer dictionary from a
+    figure caption."""
+
+    body = re.sub(r"^\s*Figure \d+[a-z]?\.?\s*", "", caption)
+    diagnosis = re.split(r"\.\s*|\s+in an?\s+\d+", body, maxsplit=1)[0].strip()
+    question = (
+        "A patient is referred for imaging. Based on the figure provided, what is the "
+        "most likely diagnosis?"
+    )
+    qa_dict = {"question": question, "answer": diagnosis or "Not available"}
+    if type_of_question == "MCQ":
+        qa_dict["options"] = f"A) {qa_dict['answer']} B) Option B C) Option C "
+        qa_dict["options"] += "D) Option D E) Option E"
+        qa_dict["answer"] = "A) " + qa_dict["answer"]
+    return qa_dict
+
+
+# ----------------------------------------------------------------------------------------
+# _mock_qa_dicts
+
+
+def _mock_qa_dicts(
+    fignum: str, caption: str, type_of_question: str, num_questions: int, leaks: bool
+) -> Union[dict, list[dict]]:
+    """An internal function to build the question-answer dictionaries of a prompt: one
+    dictionary, or a list of `num_questions` distinct ones. If `leaks` is True, the
+    questions disclose the figure number, so the leakage check flags them."""
+
+    qa_dicts = list()
+    for i in range(num_questions):
+        qa_dict = _mock_qa_dict(fignum, caption, type_of_question)
+        if i > 0:
+            qa_dict["question"] += f" (Variant {i + 1})"
+        if leaks:
+            qa_dict["question"] = f"{fignum}: {qa_dict['question']}"
+        qa_dicts.append(qa_dict)
+    return qa_dicts[0] if num_questions == 1 else qa_dicts
+
+
+# ----------------------------------------------------------------------------------------
+# _respond
+
+
+def _respond(prompt: str) -> tuple[str, str]:
+    """An internal function to get the stage of a prompt and the deterministic response
+    of the mock LLM to it: the generator answers from the caption (with the configured
+    leakage rate), the content editor rewrites the questions without leakage, and the
+    format editor repairs the dictionaries it is given."""
+
+    match = NUM_QUESTIONS_PATTERN.search(prompt)
+    num_questions = int(match.group(1)) if match else 1
+
+    match = GENERATOR_PATTERN.search(prompt)
+    if match:
+        with _rng_lock:
+            leaks = _rng.random() < settings["leakage_rate"]
+        qa_dicts = _mock_qa_dicts(
+            match["fignum"].strip(),
+            match["caption"].strip(),
+            TYPE_PATTERN.search(prompt).group(1),
+            num_questions,
+            leaks,
+        )
+        return "generator", repr(qa_dicts)
+
+    match = CONTENT_EDITOR_PATTERN.search(prompt)
+    if match:
+        qa_dicts = _mock_qa_dicts(
+            None, match["caption"].strip(), match["type"], num_questions, False
+        )
+        return "content_editor", repr(qa_dicts)
+
+    match = FORMAT_EDITOR_PATTERN.search(prompt)
+    if match:
+        # Restoring the opening brace dropped by a simulated invalid response
+        return "format_editor", re.sub(r"^(\[?)(?=['\"])", r"\1{", match["qa"].strip())
+
+    raise ValueError("The prompt is not one of the prompts of the pipeline.")
+
+
+# ----------------------------------------------------------------------------------------
+# chat
+
+
+def chat(
+    prompt: str,
+    model: str,
+    temperature: float,
+    on_token: callable = None,
+    max_tokens: int = 2000,
+    max_retries: int = None,
+    claim: callable = None,
+    on_retry: callable = None,
+) -> str:
+    """A function with the same interface as `radqg.llm.openai._chat` that answers the
+    prompts of the pipeline deterministically (see `_respond`) after the simulated
+    latency of their stage, with the configured rate of invalid responses."""
+
+    stage, response = _respond(prompt)
+    median, spread = settings["stage_latencies"].get(stage, (0.0, 0.0))
+    with _rng_lock:
+        latency = median * math.exp(_rng.gauss(0, spread)) if median > 0 else 0.0
+        failed = _rng.random() < settings["failure_rates"].get(stage, 0.0)
+    if failed:
+        response = response.replace("{", "", 1)
+
+    if on_token is None:
+        time.sleep(latency)
+        return response
+
+    # Spreading the latency over the streamed tokens
+    tokens = re.findall(r"\S+\s*", response)
+    for i, token in enumerate(tokens):
+        time.sleep(latency / len(tokens))
+        if i == 0 and claim is not None and not claim():
+            return None
+        on_token(token)
+    return response
+
+
+# ----------------------------------------------------------------------------------------
+# qa
+
+
+def qa(*args, **kwargs) -> tuple:
+    """A function with the same interface as `radqg.llm.openai.qa` that runs the real
+    pipeline (checkpoints, retries, routing, hedging, and the leakage check) with the
+    mock LLM (see `chat`) and approximate token counts, so that neither an API key nor
+    a tokenizer download is needed."""
+
+    kwargs.setdefault("chat_fn", chat)
+    kwargs.setdefault("count_tokens_fn", _count_tokens)
+    return openai_qa(*args, **kwargs)
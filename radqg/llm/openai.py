@@ -2,10 +2,19 @@
 # Description: A script containing general functionalites for working with OpenAI API.
 ##########################################################################################
 
+import time
 import openai
+import requests
 import radqg.configs as configs
+import radqg.tracing as tracing
+from radqg.cancellation import CancellationToken
 from radqg.prompts import get_generator_prompt
 from radqg.prompts import get_contenteditor_prompt, get_formateditor_prompt
+from radqg.leakage import check_leakage, record_leakage_check, split_qa_dict_strings
+from radqg.llm.backend import Backend
+from radqg.llm.governor import CircuitOpenError, Governor
+from radqg.llm.hedging import HedgingPolicy
+from radqg.llm.router import ModelRouter
 from radqg.utils import count_tokens
 
 # ----------------------------------------------------------------------------------------
@@ -14,6 +23,75 @@ from radqg.utils import count_tokens
 openai.api_key = configs.OPENAI_API_KEY
 price_for_gpt4_tokens: float = 0.03 / 1000  # $0.03 per 1000 tokens
 price_for_chatgpt_tokens: float = 0.0015 / 1000  # $0.01 per 1000 tokens
+prices_per_token = {
+    "gpt-4": price_for_gpt4_tokens,
+    "gpt-4-32k": 0.06 / 1000,
+    "gpt-3.5-turbo": price_for_chatgpt_tokens,
+    "gpt-3.5-turbo-16k": 0.003 / 1000,
+    **configs.CUSTOM_MODEL_PRICES,
+}
+
+# Backends of the chat and embedding calls, sharing one pool of keep-alive connections
+chat_backend = Backend(
+    base_url=configs.OPENAI_CHAT_BASE_URL,
+    api_key=configs.OPENAI_API_KEY,
+    connect_timeout=configs.HTTP_CONNECT_TIMEOUT,
+    read_timeout=configs.OPENAI_REQUEST_TIMEOUT,
+    pool_size=configs.HTTP_POOL_SIZE,
+)
+embedding_backend = Backend(
+    base_url=configs.OPENAI_EMBEDDING_BASE_URL,
+    api_key=configs.OPENAI_API_KEY,
+    connect_timeout=configs.HTTP_CONNECT_TIMEOUT,
+    read_timeout=configs.OPENAI_REQUEST_TIMEOUT,
+    session=chat_backend.session,
+)
+
+# The SDK otherwise opens a new session (and new connections) for every thread. The
+# session is global to the SDK, so the embedding backend shares it (see Backend).
+openai.requestssession = chat_backend.session
+
+# A governor shared by all the calls to the OpenAI API from this process
+governor = Governor(
+    rpm_limits=configs.OPENAI_RPM_LIMITS,
+    tpm_limits=configs.OPENAI_TPM_LIMITS,
+    max_retries=configs.OPENAI_MAX_RETRIES,
+    base_delay=configs.OPENAI_RETRY_BASE_DELAY,
+    max_delay=configs.OPENAI_RETRY_MAX_DELAY,
+    failure_threshold=configs.CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=configs.CIRCUIT_RESET_TIMEOUT,
+)
+retryable_errors = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+    # Raised while reading a stream whose connection is dropped
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+# A router choosing the model of each stage, shared by all the calls of this process
+router = ModelRouter(
+    fallback_models=configs.ROUTER_FALLBACK_MODELS,
+    latency_targets=configs.ROUTER_LATENCY_TARGETS,
+    cost_targets=configs.ROUTER_COST_TARGETS,
+    prices=prices_per_token,
+    is_available=lambda model: not governor.get_breaker(model).is_open(),
+    fallback_errors=retryable_errors + (CircuitOpenError,),
+    window=configs.ROUTER_LATENCY_WINDOW,
+    fallback_retries=configs.ROUTER_FALLBACK_RETRIES,
+)
+
+# A policy hedging the slow calls of each stage, shared by all the calls of this process
+hedging = HedgingPolicy(
+    percentile=configs.HEDGING_PERCENTILE,
+    min_samples=configs.HEDGING_MIN_SAMPLES,
+    max_hedge_ratio=configs.HEDGING_MAX_RATIO,
+    window=configs.HEDGING_WINDOW,
+)
 
 # ----------------------------------------------------------------------------------------
 # get_price_for_tokens
@@ -22,12 +100,23 @@ price_for_chatgpt_tokens: float = 0.0015 / 1000  # $0.01 per 1000 tokens
 def get_price_for_tokens(total_tokens: int, model: str) -> float:
     """A function to calculate the price for a given number of tokens."""
 
-    if model == "gpt-4":
-        return total_tokens * price_for_gpt4_tokens
-    elif model == "gpt-3.5-turbo":
-        return total_tokens * price_for_chatgpt_tokens
-    else:
+    if model not in prices_per_token:
         raise ValueError("The model is not supported.")
+    return total_tokens * prices_per_token[model]
+
+
+# ----------------------------------------------------------------------------------------
+# _get_retry_after
+
+
+def _get_retry_after(error: openai.error.OpenAIError) -> float:
+    """An internal function to read the retry-after header (in seconds) of an error."""
+
+    headers = getattr(error, "headers", None) or dict()
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
 
 
 # ----------------------------------------------------------------------------------------
@@ -39,7 +128,18 @@ def embed_fn(
 ) -> list[float]:
     """A function to embed a list of texts using OpenAI API."""
 
-    response = openai.Embedding.create(model=model, input=text_list_to_embed)
+    response = governor.call(
+        model,
+        lambda: openai.Embedding.create(
+            model=model,
+            input=text_list_to_embed,
+            **embedding_backend.get_request_kwargs(),
+        ),
+        tokens=sum(count_tokens(text) for text in text_list_to_embed),
+        retryable=retryable_errors,
+        throttled=(openai.error.RateLimitError,),
+        get_retry_after=_get_retry_after,
+    )
     embeddings = [
         response["data"][i]["embedding"] for i in range(len(response["data"]))
     ]
@@ -47,6 +147,273 @@ def embed_fn(
     return embeddings
 
 
+# ----------------------------------------------------------------------------------------
+# _chat
+
+
+def _chat(
+    prompt: str,
+    model: str,
+    temperature: float,
+    on_token: callable = None,
+    max_tokens: int = 2000,
+    max_retries: int = None,
+    claim: callable = None,
+    on_retry: callable = None,
+) -> str:
+    """An internal function to get the response of an OpenAI chat model to a prompt.
+    If `on_token` is given, the response is streamed and each piece of text is passed
+    to it as soon as it arrives. The stream is read within the governed call, so an
+    error in the middle of the stream is retried like any other (`on_retry` is called
+    before the stream starts over, if some text has already been passed to
+    `on_token`). `max_retries` overrides the retries of the governor. If `claim` is
+    given (see `radqg.llm.hedging.HedgingPolicy`), it is called once a streamed
+    response starts to arrive, and None is returned (closing the stream) if it
+    returns False. A response that is not streamed cannot be abandoned midway, so
+    `claim` is only used with `on_token`."""
+
+    streamed = False
+
+    def request() -> str:
+        nonlocal streamed
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            frequency_penalty=0.0,
+            stream=on_token is not None,
+            **chat_backend.get_request_kwargs(),
+        )
+        if on_token is None:
+            return response.choices[0]["message"]["content"]
+
+        if streamed and on_retry is not None:
+            on_retry()
+        content = ""
+        for i, chunk in enumerate(response):
+            # Stopping the stream closes the connection of a cancelled request
+            if i == 0 and claim is not None and not claim():
+                return None
+            text = chunk.choices[0]["delta"].get("content", "")
+            if text:
+                content += text
+                streamed = True
+                on_token(text)
+        return content
+
+    # The requested max_tokens counts towards the tokens-per-minute limit
+    return governor.call(
+        model,
+        request,
+        tokens=count_tokens(prompt) + max_tokens,
+        retryable=retryable_errors,
+        throttled=(openai.error.RateLimitError,),
+        get_retry_after=_get_retry_after,
+        max_retries=max_retries,
+    )
+
+
+# ----------------------------------------------------------------------------------------
+# _parse_qa_dict
+
+
+def _parse_qa_dict(qa_dict_string: str) -> dict:
+    """An internal function to convert the response of the format editor to a Python
+    dictionary."""
+
+    try:
+        qa_dict = eval(qa_dict_string)
+    except Exception:
+        qa_dict = None
+    assert isinstance(
+        qa_dict, dict
+    ), f"The following string is not a valid Python dictionary:\n{qa_dict_string}"
+
+    return qa_dict
+
+
+# ----------------------------------------------------------------------------------------
+# _parse_qa_list
+
+
+def _parse_qa_list(qa_list_string: str, num_questions: int) -> list[dict]:
+    """An internal function to convert the response of the format editor to a list of
+    `num_questions` Python dictionaries."""
+
+    try:
+        qa_list = eval(qa_list_string)
+    except Exception:
+        qa_list = None
+    valid = isinstance(qa_list, (list, tuple)) and len(qa_list) == num_questions
+    assert valid and all(
+        isinstance(qa_dict, dict) for qa_dict in qa_list
+    ), f"The following string is not a list of {num_questions} dictionaries:\n{qa_list_string}"
+
+    return list(qa_list)
+
+
+# ----------------------------------------------------------------------------------------
+# _record_spend
+
+
+def _record_spend(checkpoint: dict, tokens: int, cost: float):
+    """An internal function to add the tokens and cost of a call to the spend of a
+    checkpoint ({"spend": {"tokens": ..., "cost": ...}}), which, unlike the tokens and
+    cost of its stages, includes the calls of the stages that failed."""
+
+    spend = checkpoint.setdefault("spend", {"tokens": 0, "cost": 0.0})
+    spend["tokens"] += tokens
+    spend["cost"] += cost
+
+
+# ----------------------------------------------------------------------------------------
+# _run_stage
+
+
+def _run_stage(
+    checkpoint: dict,
+    stage: str,
+    prompt: str,
+    model: str,
+    temperature: float,
+    parse_fn: callable = None,
+    max_attempts: int = configs.MAX_STAGE_ATTEMPTS,
+    backoff: float = configs.STAGE_RETRY_BACKOFF,
+    on_event: callable = None,
+    max_tokens: int = 2000,
+    router: ModelRouter = None,
+    hedging: HedgingPolicy = None,
+    cancel_token: CancellationToken = None,
+    chat_fn: callable = _chat,
+    count_tokens_fn: callable = count_tokens,
+) -> str:
+    """An internal function to run one stage of the pipeline with bounded retries for
+    invalid responses (API errors are retried by the governor) and save its output in
+    the checkpoint. If the checkpoint already holds the output of the stage, the LLM is
+    not called again. If `on_event` is given, the stage is reported to it and its
+    response is streamed to it token by token. If a `router` is given, it chooses the
+    model of each attempt (starting from `model`), and the model that served the stage
+    is saved in the checkpoint. If a `hedging` policy is given, slow streamed calls
+    are hedged (the prompt tokens of a cancelled duplicate call are paid for as well);
+    calls that are not streamed are never hedged, since the losing duplicate could
+    not be cancelled and would be paid for in full. If the
+    `cancel_token` is cancelled, CancelledError is raised before the next attempt or
+    streamed token. The LLM is called with `chat_fn` (see `_chat`) and the tokens are
+    counted with `count_tokens_fn`. Every call is added to the spend of the checkpoint
+    (see `_record_spend`), including the calls that fail or are cancelled once their
+    response has started to stream."""
+
+    if stage in checkpoint:
+        return checkpoint[stage]["response"]
+
+    on_token, on_retry, streamed = None, None, list()
+    if on_event is not None:
+        on_event({"event": "stage", "stage": stage})
+
+        def on_token(text: str):
+            streamed.append(text)
+            if cancel_token is not None:
+                cancel_token.check()
+            on_event({"event": "token", "stage": stage, "text": text})
+
+        def on_retry():
+            on_event({"event": "retry", "stage": stage})
+
+    def call_model(candidate: str, max_retries: int = None) -> str:
+        nonlocal num_hedged, serving_model
+        serving_model = candidate
+        with tracing.span(f"llm_{stage}", model=candidate, attempt=attempt):
+            if hedging is None or on_token is None:
+                return chat_fn(
+                    prompt,
+                    model=candidate,
+                    temperature=temperature,
+                    on_token=on_token,
+                    max_tokens=max_tokens,
+                    max_retries=max_retries,
+                    on_retry=on_retry,
+                )
+            response, hedged = hedging.call(
+                f"{stage}:{candidate}",
+                lambda claim: chat_fn(
+                    prompt,
+                    model=candidate,
+                    temperature=temperature,
+                    on_token=on_token,
+                    max_tokens=max_tokens,
+                    max_retries=max_retries,
+                    claim=claim,
+                    on_retry=on_retry,
+                ),
+            )
+            num_hedged += hedged
+            return response
+
+    # Rejected responses are paid for as well
+    tokens, cost, num_hedged = 0, 0.0, 0
+    with tracing.span(f"qa_{stage}", model=model) as attrs:
+        for attempt in range(max_attempts):
+            if cancel_token is not None:
+                cancel_token.check()
+            streamed.clear()
+            serving_model = model
+            labels = {"stage": stage, "model": model}
+            try:
+                if router is None:
+                    response, served_model = call_model(model), model
+                else:
+                    response, served_model = router.call(stage, model, call_model)
+                attempt_tokens = count_tokens_fn(prompt) * (1 + num_hedged)
+                attempt_tokens += count_tokens_fn(response)
+                num_hedged = 0
+                attempt_cost = get_price_for_tokens(attempt_tokens, served_model)
+                tokens, cost = tokens + attempt_tokens, cost + attempt_cost
+                _record_spend(checkpoint, attempt_tokens, attempt_cost)
+                labels["model"] = served_model
+                tracing.increment("llm_calls_total", **labels)
+                tracing.increment("llm_tokens_total", attempt_tokens, **labels)
+                tracing.increment("llm_cost_dollars_total", attempt_cost, **labels)
+                if parse_fn is not None:
+                    with tracing.span("qa_parse", stage=stage):
+                        parse_fn(response)
+                break
+            except AssertionError as error:
+                if attempt == max_attempts - 1:
+                    tracing.increment("llm_failures_total", **labels)
+                    raise
+                print(
+                    f'Stage "{stage}" failed ({type(error).__name__}); trying again...'
+                )
+                tracing.increment("llm_retries_total", **labels)
+                if on_event is not None:
+                    on_event({"event": "retry", "stage": stage})
+                time.sleep(backoff * 2**attempt)
+            except Exception:
+                # The prompt and the streamed text of a broken call are paid for, at
+                # the price of the model that was streaming it
+                if streamed:
+                    failed_tokens = count_tokens_fn(prompt) * (1 + num_hedged)
+                    failed_tokens += count_tokens_fn("".join(streamed))
+                    _record_spend(
+                        checkpoint,
+                        failed_tokens,
+                        get_price_for_tokens(failed_tokens, serving_model),
+                    )
+                raise
+            finally:
+                attrs.update(attempts=attempt + 1, tokens=tokens)
+        attrs["model"] = served_model
+
+    checkpoint[stage] = {
+        "response": response,
+        "model": served_model,
+        "tokens": tokens,
+        "cost": cost,
+    }
+    return response
+
+
 # ----------------------------------------------------------------------------------------
 # qa
 
@@ -59,12 +426,59 @@ def qa(
     generator_model: str = configs.OPENAI_GENERATOR_MODEL,
     content_editor_model: str = configs.OPENAI_CONTENT_EDITOR_MODEL,
     format_editor_model: str = configs.OPENAI_FORMAT_EDITOR_MODEL,
+    leakage_check_mode: str = configs.LEAKAGE_CHECK_MODE,
+    leakage_strictness: float = configs.LEAKAGE_STRICTNESS,
+    checkpoint: dict = None,
+    max_stage_attempts: int = configs.MAX_STAGE_ATTEMPTS,
+    on_event: callable = None,
+    num_questions: int = 1,
+    use_router: bool = configs.USE_MODEL_ROUTER,
+    use_hedging: bool = configs.USE_HEDGING,
+    cancel_token: CancellationToken = None,
+    chat_fn: callable = _chat,
+    count_tokens_fn: callable = count_tokens,
 ) -> dict:
-    """A function to generate a question from a figure caption using the OpenAI LLMs."""
+    """A function to generate a question from a figure caption using the OpenAI LLMs.
+    The content editor is skipped when the local leakage check finds the generated
+    question clean, unless the leakage check mode is "report" or "off".
 
-    # To check the total number of tokens and budget used.
-    total_tokens = 0
-    total_cost = 0
+    Each stage is retried on its own, and its output is saved in the `checkpoint`
+    dictionary (if given). Passing the same checkpoint again after a failure resumes
+    the pipeline from the failed stage. The tokens and cost of every call made with
+    the checkpoint, including the calls that failed, add up in its "spend" entry.
+
+    If `on_event` is given, it receives a dictionary for every stage that starts
+    ({"event": "stage", ...}), is skipped ({"event": "skip", ...}), or is retried
+    ({"event": "retry", ...}), and for every streamed token ({"event": "token", ...}).
+
+    If `num_questions` is more than one, the generator is asked for that many distinct
+    questions in one call, the editors process them as a batch, and a list of
+    question-answer dictionaries is returned in place of a single dictionary. The
+    content editor is then skipped only if none of the questions leaks the caption.
+
+    If `use_router` is True, the given models are preferred, but each stage may be
+    served by a fallback model (see `radqg.llm.router.ModelRouter`) when the given
+    model is too slow, too costly, or failing. The model that served each stage is
+    saved in the checkpoint. If `use_hedging` is True, a duplicate call is sent when
+    a streamed call of a stage (i.e., with `on_event`) is slower than usual (see
+    `radqg.llm.hedging.HedgingPolicy`).
+
+    If a `cancel_token` is given and cancelled (e.g., because the user abandoned the
+    request), CancelledError is raised before the next stage, attempt, or streamed
+    token, so that no more tokens are paid for.
+
+    The LLMs are called with `chat_fn` and the tokens are counted with
+    `count_tokens_fn`, which can be replaced to run the pipeline without the API (see
+    `radqg.llm.mock`).
+    """
+
+    assert leakage_check_mode in ["skip", "report", "off"]
+    assert num_questions >= 1
+    # Failing before any call rather than after a call that cannot be priced
+    router.check_prices([generator_model, content_editor_model, format_editor_model])
+    max_tokens = max(2000, 1000 * num_questions)
+    if checkpoint is None:
+        checkpoint = dict()
 
     print(f"fignum: {fignum}")
 
@@ -74,58 +488,112 @@ def qa(
         figure_caption=caption,
         context=context,
         type_of_question=type_of_question,
+        num_questions=num_questions,
     )
-    good_question_created = False
-    message1 = [{"role": "user", "content": prompt1}]
-    response1 = openai.ChatCompletion.create(
+    out_dict_string1 = _run_stage(
+        checkpoint,
+        "generator",
+        prompt1,
         model=generator_model,
-        messages=message1,
         temperature=0.6,
-        max_tokens=2000,
-        frequency_penalty=0.0,
-    )
-    out_dict_string1 = response1.choices[0]["message"]["content"]
-    total_tokens += count_tokens(prompt1) + count_tokens(out_dict_string1)
-    total_cost += get_price_for_tokens(
-        total_tokens, model=configs.OPENAI_GENERATOR_MODEL
+        max_attempts=max_stage_attempts,
+        on_event=on_event,
+        max_tokens=max_tokens,
+        router=router if use_router else None,
+        hedging=hedging if use_hedging else None,
+        cancel_token=cancel_token,
+        chat_fn=chat_fn,
+        count_tokens_fn=count_tokens_fn,
     )
 
+    # Checking locally whether the question discloses the caption
+    needs_content_edit = True
+    if leakage_check_mode != "off":
+        if "leakage" not in checkpoint:
+            with tracing.span("leakage_check"):
+                if num_questions == 1:
+                    leakage = check_leakage(
+                        out_dict_string1,
+                        caption,
+                        type_of_question,
+                        strictness=leakage_strictness,
+                    )
+                else:
+                    checks = [
+                        check_leakage(
+                            item, caption, type_of_question, leakage_strictness
+                        )
+                        for item in split_qa_dict_strings(out_dict_string1)
+                    ]
+                    leaked = len(checks) != num_questions or any(
+                        check["leaked"] for check in checks
+                    )
+                    leakage = {"leaked": leaked, "questions": checks}
+            checkpoint["leakage"] = leakage
+            skipped = not leakage["leaked"] and leakage_check_mode == "skip"
+            record_leakage_check(leakage["leaked"], skipped=skipped)
+            if configs.VERBOSE and not leakage["leaked"]:
+                print("No leakage detected in the generated question.")
+        needs_content_edit = (
+            checkpoint["leakage"]["leaked"] or leakage_check_mode == "report"
+        )
+
     # Asking for double-checking the question and answer generation
-    prompt2 = get_contenteditor_prompt(caption, out_dict_string1, type_of_question)
-    message2 = [{"role": "user", "content": prompt2}]
-    response2 = openai.ChatCompletion.create(
-        model=content_editor_model,
-        messages=message2,
-        temperature=0.6,
-        max_tokens=2000,
-        frequency_penalty=0.0,
-    )
-    out_dict_string2 = response2.choices[0]["message"]["content"]
-    total_tokens += count_tokens(prompt2) + count_tokens(out_dict_string2)
-    total_cost += get_price_for_tokens(
-        total_tokens, model=configs.OPENAI_CONTENT_EDITOR_MODEL
-    )
+    out_dict_string2 = out_dict_string1
+    if needs_content_edit:
+        prompt2 = get_contenteditor_prompt(
+            caption, out_dict_string1, type_of_question, num_questions=num_questions
+        )
+        out_dict_string2 = _run_stage(
+            checkpoint,
+            "content_editor",
+            prompt2,
+            model=content_editor_model,
+            temperature=0.6,
+            max_attempts=max_stage_attempts,
+            on_event=on_event,
+            max_tokens=max_tokens,
+            router=router if use_router else None,
+            hedging=hedging if use_hedging else None,
+            cancel_token=cancel_token,
+            chat_fn=chat_fn,
+            count_tokens_fn=count_tokens_fn,
+        )
+    elif on_event is not None:
+        on_event({"event": "skip", "stage": "content_editor"})
 
     # Asking for the dictionary formatting
-    out_dict_string3 = out_dict_string2
-    prompt3 = get_formateditor_prompt(out_dict_string3)
-    message3 = [{"role": "user", "content": prompt3}]
-    response3 = openai.ChatCompletion.create(
+    prompt3 = get_formateditor_prompt(out_dict_string2, num_questions=num_questions)
+    if num_questions == 1:
+        parse_fn = _parse_qa_dict
+    else:
+        parse_fn = lambda string: _parse_qa_list(string, num_questions)
+    out_dict_string3 = _run_stage(
+        checkpoint,
+        "format_editor",
+        prompt3,
         model=format_editor_model,
-        messages=message3,
         temperature=0.2,
-        max_tokens=2000,
-        frequency_penalty=0.0,
+        parse_fn=parse_fn,
+        max_attempts=max_stage_attempts,
+        on_event=on_event,
+        max_tokens=max_tokens,
+        router=router if use_router else None,
+        hedging=hedging if use_hedging else None,
+        cancel_token=cancel_token,
+        chat_fn=chat_fn,
+        count_tokens_fn=count_tokens_fn,
     )
-    out_dict_string3 = response3.choices[0]["message"]["content"]
-    total_tokens += count_tokens(prompt3) + count_tokens(out_dict_string3)
-    total_cost += get_price_for_tokens(
-        total_tokens, model=configs.OPENAI_FORMAT_EDITOR_MODEL
-    )
-    qa_dict = eval(out_dict_string3)
-    assert isinstance(
-        qa_dict, dict
-    ), f"The following string is not a valid Python dictionary:\n{out_dict_string3}"
+    qa_dict = parse_fn(out_dict_string3)
+
+    # To check the total number of tokens and budget used.
+    stages = [
+        checkpoint[key]
+        for key in ["generator", "content_editor", "format_editor"]
+        if key in checkpoint
+    ]
+    total_tokens = sum(stage["tokens"] for stage in stages)
+    total_cost = sum(stage["cost"] for stage in stages)
 
     return (
         qa_dict,
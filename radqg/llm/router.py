@@ -0,0 +1,153 @@
+##########################################################################################
+# Description: A script containing a cost- and latency-aware model router for the LLM
+# stages of the pipeline.
+##########################################################################################
+
+import collections
+import threading
+import time
+import radqg.tracing as tracing
+
+# ----------------------------------------------------------------------------------------
+# ModelRouter
+
+
+class ModelRouter:
+    """A class for choosing the model that serves each stage of the pipeline. The model
+    requested for a stage is preferred, followed by its fallback models, but a model is
+    passed over while its rolling latency for the stage reaches the latency target of
+    the stage, while its price is above the cost target of the stage, or while it is
+    unavailable (e.g., its circuit is open). If a call fails with one of the fallback
+    errors (e.g., a timeout or a rate limit), the next model is tried."""
+
+    def __init__(
+        self,
+        fallback_models: dict = None,
+        latency_targets: dict = None,
+        cost_targets: dict = None,
+        prices: dict = None,
+        is_available: callable = None,
+        fallback_errors: tuple = (),
+        window: float = 300.0,
+        fallback_retries: int = 1,
+    ):
+        """The constructor of the ModelRouter class. `cost_targets` and `prices` are in
+        dollars per 1000 tokens and dollars per token, respectively, and `window` is the
+        number of seconds for which latency samples are kept. If `prices` are given,
+        every fallback model must have one, so that no call is made to a model whose
+        tokens cannot be paid for."""
+
+        self.fallback_models = fallback_models or dict()
+        self.latency_targets = latency_targets or dict()
+        self.cost_targets = cost_targets or dict()
+        self.prices = prices or dict()
+        self.is_available = is_available or (lambda model: True)
+        self.fallback_errors = fallback_errors
+        self.window = window
+        self.fallback_retries = fallback_retries
+        self._latencies = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        if self.prices:
+            models = [m for ms in self.fallback_models.values() for m in ms]
+            self.check_prices(models)
+
+    def check_prices(self, models: list[str]):
+        """A method to raise ValueError if some of the models have no price."""
+
+        unpriced = sorted(set(models) - set(self.prices))
+        if unpriced:
+            raise ValueError(f"No price is configured for the models: {unpriced}")
+
+    def get_candidates(self, stage: str, model: str) -> list[str]:
+        """A method to get the requested model of a stage and its fallback models."""
+
+        return list(dict.fromkeys([model] + self.fallback_models.get(stage, [])))
+
+    def record_latency(self, stage: str, model: str, latency: float):
+        """A method to record the latency (in seconds) of a call of a stage."""
+
+        with self._lock:
+            self._latencies[(stage, model)].append((time.monotonic(), latency))
+
+    def get_latency(self, stage: str, model: str) -> float:
+        """A method to get the rolling mean latency of a model for a stage, or None if
+        the model has not served the stage recently."""
+
+        with self._lock:
+            samples = self._latencies[(stage, model)]
+            while samples and time.monotonic() - samples[0][0] > self.window:
+                samples.popleft()
+            if not samples:
+                return None
+            return sum(latency for _, latency in samples) / len(samples)
+
+    def _meets_targets(self, stage: str, model: str) -> bool:
+        """An internal method to check a model against the targets of a stage."""
+
+        cost_target = self.cost_targets.get(stage)
+        if cost_target is not None and model in self.prices:
+            if self.prices[model] * 1000 > cost_target:
+                return False
+        latency_target = self.latency_targets.get(stage)
+        latency = self.get_latency(stage, model)
+        if latency_target is not None and latency is not None:
+            if latency >= latency_target:
+                return False
+        return True
+
+    def rank(self, stage: str, model: str) -> list[str]:
+        """A method to order the candidate models of a stage: the available models that
+        meet the targets in their order of preference, then the rest by their rolling
+        latency (unavailable models last)."""
+
+        candidates = self.get_candidates(stage, model)
+        preferred = [
+            candidate
+            for candidate in candidates
+            if self.is_available(candidate) and self._meets_targets(stage, candidate)
+        ]
+        others = sorted(
+            [candidate for candidate in candidates if candidate not in preferred],
+            key=lambda candidate: (
+                not self.is_available(candidate),
+                self.get_latency(stage, candidate) or 0.0,
+            ),
+        )
+        return preferred + others
+
+    def call(self, stage: str, model: str, fn: callable) -> tuple:
+        """A method to call `fn(model, max_retries)` with the best ranked model of a
+        stage, falling back to the next model on the fallback errors. Every model but
+        the last is only retried `fallback_retries` times (`max_retries` is None for
+        the last one). Returns the result and the model that served the call."""
+
+        ranked = self.rank(stage, model)
+        if self.prices:
+            self.check_prices(ranked)
+        for i, candidate in enumerate(ranked):
+            is_last = i == len(ranked) - 1
+            start = time.monotonic()
+            try:
+                result = fn(candidate, None if is_last else self.fallback_retries)
+            except self.fallback_errors as error:
+                if is_last:
+                    raise
+                # The failed model is recorded as at least as slow as the target
+                latency = time.monotonic() - start
+                target = self.latency_targets.get(stage) or 0.0
+                self.record_latency(stage, candidate, max(latency, target))
+                tracing.increment(
+                    "router_fallbacks_total",
+                    stage=stage,
+                    model=candidate,
+                    error=type(error).__name__,
+                )
+                print(
+                    f"{type(error).__name__} for {candidate}; "
+                    f"falling back to {ranked[i + 1]}..."
+                )
+                continue
+            self.record_latency(stage, candidate, time.monotonic() - start)
+            if candidate != model:
+                tracing.increment("router_reroutes_total", stage=stage, model=candidate)
+            return result, candidate
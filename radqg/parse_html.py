@@ -6,6 +6,22 @@ import os
 import re
 from bs4 import BeautifulSoup
 
+# ----------------------------------------------------------------------------------------
+# Configurations
+
+# In-text references to figures, e.g., "Fig 5", "Figs 2, 3", "Fig 10b, 10c", "Figs 9–13".
+# A number after the first one (e.g., after a comma, a space, or "and") is only part of
+# the reference if the reference is plural, inside parentheses, or followed by a
+# delimiter (unlike "as in Fig 5 and 6 patients" or "Figure 3, 20 patients").
+MENTION_NUMBER = r"\d+[a-z]?(?:\s*[–-][,\s]*\d+[a-z]?)?"
+MENTION_PATTERN = re.compile(
+    r"(?P<parenthesis>\([^()]*?)?\bFig(?:ure)?(?P<plural>s)?\.?\s*(?P<numbers>"
+    rf"{MENTION_NUMBER}(?:[,\s]*(?:and\s+)?{MENTION_NUMBER}"
+    r"(?(parenthesis)|(?(plural)|(?=\s*(?:[),;.:]|$)))))*)"
+)
+MENTION_NUMBER_PATTERN = re.compile(r"(\d+)[a-z]?(?:\s*[–-][,\s]*(\d+))?")
+MAX_MENTION_RANGE = 50
+
 # ----------------------------------------------------------------------------------------
 # retrieve_figures
 
@@ -63,13 +79,126 @@ def retrieve_figures(root_directory: str) -> list[dict]:
     return figures_list
 
 
+# ----------------------------------------------------------------------------------------
+# get_caption_body
+
+
+def get_caption_body(caption_text: str) -> str:
+    """A function to remove the label (e.g., "Figure 2a.") from a figure caption, which
+    is all that differs between the captions of the panels of a figure."""
+
+    return re.sub(r"^Figure \d+[a-z]?\.?\s*", "", caption_text)
+
+
+# ----------------------------------------------------------------------------------------
+# get_figure_mentions
+
+
+def get_figure_mentions(text: str) -> list[int]:
+    """A function to find the numbers of the figures referenced in a text (e.g., "(Fig
+    5)" or "(Figs 9–11)"), in ascending order. Panels are referenced by the number of
+    their figure.
+
+    >>> get_figure_mentions("(Figs 2, 3, and 9–11) and Figure 5b and 6.")
+    [2, 3, 5, 6, 9, 10, 11]
+    >>> get_figure_mentions("as in Fig 5 and 6 patients had (Fig 7 and 8 in the text)")
+    [5, 7, 8]
+    >>> get_figure_mentions("As shown in Figure 3, 20 patients had")
+    [3]
+    >>> get_figure_mentions("Figure 7 6 months later")
+    [7]
+    """
+
+    numbers = set()
+    for match in MENTION_PATTERN.finditer(text):
+        for start, end in MENTION_NUMBER_PATTERN.findall(match.group("numbers")):
+            start, end = int(start), int(end or start)
+            if start <= end <= start + MAX_MENTION_RANGE:
+                numbers.update(range(start, end + 1))
+    return sorted(numbers)
+
+
+# ----------------------------------------------------------------------------------------
+# is_section_heading
+
+
+def is_section_heading(tag) -> bool:
+    """A function to check whether an HTML tag is the heading of a section or a
+    subsection of an article (other h3 tags belong to widgets, e.g., "We recommend")."""
+
+    if tag.name == "h2":
+        return True
+    return tag.name == "h3" and "article-section__title" in tag.get("class", [])
+
+
+# ----------------------------------------------------------------------------------------
+# build_article
+
+
+def build_article(
+    file_path: str, file_name: str, title_text: str, section_texts: list[dict]
+) -> dict:
+    """A function to build an article (see `retrieve_articles`) from its title and the
+    titles, heading levels, and paragraphs of its sections."""
+
+    # Concatenating the sections after the title, recording their character offsets
+    # (the first section includes the title)
+    title_text = re.sub(" +", " ", title_text).strip()
+    full_text = title_text
+    paragraphs, sections = list(), list()
+    for section in section_texts:
+        if not section["paragraphs"]:
+            continue
+        start = len(full_text) + 1 if sections else 0
+        full_text = " ".join([full_text] + section["paragraphs"]).strip()
+        paragraphs += section["paragraphs"]
+        sections.append(
+            {
+                "title": section["title"],
+                "level": section["level"],
+                "paragraphs": section["paragraphs"],
+                "start": start,
+                "end": len(full_text),
+            }
+        )
+    if not sections:
+        sections.append(
+            {
+                "title": "",
+                "level": 1,
+                "paragraphs": [],
+                "start": 0,
+                "end": len(full_text),
+            }
+        )
+
+    # Indexing the paragraphs by the figures they reference
+    figure_mentions = dict()
+    for i, paragraph in enumerate(paragraphs):
+        for number in get_figure_mentions(paragraph):
+            figure_mentions.setdefault(number, list()).append(i)
+
+    return {
+        "article_file_path": file_path,
+        "article_file_name": file_name,
+        "article_title": title_text,
+        "article_full_text": full_text,
+        "paragraphs": paragraphs,
+        "sections": sections,
+        "figure_mentions": figure_mentions,
+    }
+
+
 # ----------------------------------------------------------------------------------------
 # retrieve_articles
 
 
 def retrieve_articles(root_directory: str) -> list[dict]:
     """A function to retrieve full texts from a given directory of saved RadioGraphics
-    articles in the format of HTML files."""
+    articles in the format of HTML files. The paragraphs of each article are kept as
+    well, with an index of the paragraphs that reference each figure number, and its
+    sections, with their titles, heading levels, paragraphs, and the start and end
+    offsets of their text in the full text."""
 
     # Traverse the root directory to get all HTML files
     articles_list = list()
@@ -85,31 +214,33 @@ def retrieve_articles(root_directory: str) -> list[dict]:
                 title_tag = soup.find("h1", class_="citation__title")
                 title_text = title_tag.get_text() if title_tag else ""
 
-                # Extract main article content
+                # Extract main article content, section by section (any paragraphs
+                # before the first heading form an untitled section)
                 article_tag = soup.find("article")
-                texts = []
+                section_texts = [{"title": "", "level": 1, "paragraphs": []}]
                 if article_tag:
-                    for p_tag in article_tag.find_all("p"):
+                    for tag in article_tag.find_all(["h2", "h3", "p"]):
+                        if is_section_heading(tag):
+                            section_texts.append(
+                                {
+                                    "title": " ".join(tag.get_text().split()),
+                                    "level": int(tag.name[1]),
+                                    "paragraphs": [],
+                                }
+                            )
+                            continue
+                        if tag.name != "p":
+                            continue
                         # Exclude text within figure and figcaption tags
-                        if p_tag.find_parent("figure") or p_tag.find_parent(
-                            "figcaption"
-                        ):
+                        if tag.find_parent("figure") or tag.find_parent("figcaption"):
                             continue
-                        texts.append(p_tag.get_text())
-
-                # Concatenate, and replace multiple spaces with a single space
-                full_text = title_text + " " + " ".join(texts)
-                full_text = re.sub(
-                    " +", " ", full_text
-                )  # Replace multiple spaces with a single space
+                        # Replace multiple spaces with a single space
+                        text = re.sub(" +", " ", tag.get_text()).strip()
+                        if text:
+                            section_texts[-1]["paragraphs"].append(text)
 
-                # Save the cleaned text in the dictionary
                 articles_list.append(
-                    {
-                        "article_file_path": file_path,
-                        "article_file_name": file,
-                        "article_full_text": full_text,
-                    }
+                    build_article(file_path, file, title_text, section_texts)
                 )
 
     return articles_list
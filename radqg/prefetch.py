@@ -0,0 +1,218 @@
+##########################################################################################
+# Description: A script containing a background prefetcher of generated questions.
+##########################################################################################
+
+import queue
+import threading
+import radqg.configs as configs
+from radqg.cancellation import CancellationToken, CancelledError
+from radqg.generator import Generator
+from radqg.qbank import QBank
+
+# ----------------------------------------------------------------------------------------
+# QuestionPrefetcher
+
+
+class QuestionPrefetcher:
+    """A class for keeping a small buffer of fully generated questions for each question
+    type, refilled by background workers, so that questions can be served instantly.
+    Figures are selected through the generator's `select_figure` method, so the
+    per-figure quota is respected by both the workers and the on-demand requests."""
+
+    def __init__(
+        self,
+        generator: Generator,
+        qa_fn: callable,
+        qbank: QBank,
+        question_types: list[str] = ["MCQ", "Short-Answer", "Long-Answer"],
+        depth: int = configs.PREFETCH_DEPTH,
+        num_workers: int = configs.PREFETCH_NUM_WORKERS,
+        max_spend: float = configs.PREFETCH_MAX_SPEND,
+        max_q_per_fig: int = 1,
+        backoff: float = configs.PREFETCH_ERROR_BACKOFF,
+        max_backoff: float = configs.PREFETCH_MAX_ERROR_BACKOFF,
+        estimated_cost: float = configs.PREFETCH_ESTIMATED_COST,
+    ):
+        """The constructor of the QuestionPrefetcher class. The qa_fn must accept a
+        `checkpoint` dictionary (see `radqg.llm.openai.qa`), from which the spend of
+        each generation is read. After an unexpected error, a worker waits `backoff`
+        seconds, doubled after each consecutive error up to `max_backoff`. Before a
+        generation starts, its cost is reserved from `max_spend`, estimated as the
+        largest cost of a generation so far (or `estimated_cost` before the first one),
+        so that the workers in flight together stay within the cap; the cap can only
+        be exceeded by a generation costing more than any before it."""
+
+        self.generator = generator
+        self.qa_fn = qa_fn
+        self.qbank = qbank
+        self.depth = depth
+        self.num_workers = num_workers
+        self.max_spend = max_spend
+        self.max_q_per_fig = max_q_per_fig
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.estimated_cost = estimated_cost
+        self.total_spend = 0.0
+        self._reserved_spend = 0.0
+        self.buffers = {qtype: queue.Queue() for qtype in question_types}
+        self._in_flight = {qtype: 0 for qtype in question_types}
+        self._condition = threading.Condition()
+        self._select_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._cancel_token = CancellationToken()
+        self._workers = list()
+
+    def start(self):
+        """A method to start the background workers. Each start has its own stop event
+        and cancellation token, so that the workers of a previous start that are still
+        finishing a stage stop as well."""
+
+        self._stop_event = threading.Event()
+        self._cancel_token = CancellationToken()
+        for _ in range(self.num_workers):
+            worker = threading.Thread(
+                target=self._work,
+                args=(self._stop_event, self._cancel_token),
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        """A method to stop the background workers, cancelling their in-flight questions
+        before their next stage."""
+
+        self._stop_event.set()
+        self._cancel_token.cancel()
+        with self._condition:
+            self._condition.notify_all()
+        self._workers = list()
+
+    def select_figure(self) -> tuple[str, str, str]:
+        """A thread-safe method to select the next figure from the question bank."""
+
+        with self._select_lock:
+            return self.generator.select_figure(
+                self.qbank,
+                max_q_per_fig=self.max_q_per_fig,
+            )
+
+    def generate(
+        self,
+        question_type: str,
+        cancel_token: CancellationToken = None,
+        checkpoint: dict = None,
+    ) -> dict:
+        """A method to select a figure and generate a question for it right away. If a
+        `checkpoint` dictionary is given, it is passed to the qa_fn, so that the spend
+        of the generation can be read from it even if the generation fails."""
+
+        qa_kwargs = dict()
+        if checkpoint is not None:
+            qa_kwargs["checkpoint"] = checkpoint
+        article_name, figpath, caption = self.select_figure()
+        qa_dict, *logs, total_tokens, total_cost = self.generator.generate_qa(
+            qa_fn=self.qa_fn,
+            article_name=article_name,
+            figpath=figpath,
+            caption=caption,
+            type_of_question=question_type,
+            complete_return=True,
+            cancel_token=cancel_token,
+            **qa_kwargs,
+        )
+        return {
+            "qa_dict": qa_dict,
+            "article_name": article_name,
+            "figpath": figpath,
+            "caption": caption,
+            "type_of_question": question_type,
+            "logs": logs,
+            "total_tokens": total_tokens,
+            "total_cost": total_cost,
+        }
+
+    def pop(self, question_type: str) -> dict:
+        """A method to take a ready question of the given type from the buffer, or
+        return None if the buffer is empty."""
+
+        try:
+            item = self.buffers[question_type].get_nowait()
+        except queue.Empty:
+            return None
+        with self._condition:
+            self._condition.notify()
+        return item
+
+    def get(self, question_type: str) -> dict:
+        """A method to get a question of the given type, generating it on demand if the
+        buffer is empty."""
+
+        item = self.pop(question_type)
+        if item is None:
+            item = self.generate(question_type)
+        return item
+
+    def _claim_type(self) -> str:
+        """An internal method to claim the question type whose buffer is the emptiest,
+        reserving the estimated cost of its generation, or return None if all the
+        buffers are full or the reserved and spent dollars would exceed the cap."""
+
+        committed_spend = self.total_spend + self._reserved_spend
+        if committed_spend + self.estimated_cost > self.max_spend:
+            return None
+        levels = {
+            qtype: self.buffers[qtype].qsize() + self._in_flight[qtype]
+            for qtype in self.buffers
+        }
+        question_type = min(levels, key=levels.get)
+        if levels[question_type] >= self.depth:
+            return None
+        self._in_flight[question_type] += 1
+        self._reserved_spend += self.estimated_cost
+        return question_type
+
+    def _work(self, stop_event: threading.Event, cancel_token: CancellationToken):
+        """An internal method run by each background worker until its `stop_event` is
+        set, generating with its `cancel_token`. Every generation is charged to the
+        spend, including the ones that fail or are cancelled, and the worker backs off
+        after an unexpected error instead of stopping."""
+
+        num_errors = 0
+        while not stop_event.is_set():
+            with self._condition:
+                question_type = self._claim_type()
+                if question_type is None:
+                    self._condition.wait(timeout=1.0)
+                    continue
+                reserved = self.estimated_cost
+            checkpoint, delay = dict(), 0.0
+            try:
+                item = self.generate(question_type, cancel_token, checkpoint)
+                self.buffers[question_type].put(item)
+                num_errors = 0
+            except CancelledError:
+                pass
+            except AssertionError:
+                print("AssertionError occured while prefetching; trying again...")
+            except StopIteration:
+                print("The question bank is exhausted; stopping the prefetcher.")
+                stop_event.set()
+            except Exception as error:
+                delay = min(self.max_backoff, self.backoff * 2**num_errors)
+                num_errors += 1
+                print(
+                    f"{type(error).__name__} occured while prefetching ({error}); "
+                    f"retrying in {delay:.1f}s..."
+                )
+            finally:
+                # Settling the reservation with the actual cost
+                cost = checkpoint.get("spend", {}).get("cost", 0.0)
+                with self._condition:
+                    self._in_flight[question_type] -= 1
+                    self._reserved_spend -= reserved
+                    self.total_spend += cost
+                    self.estimated_cost = max(self.estimated_cost, cost)
+                    self._condition.notify_all()
+            if delay > 0:
+                stop_event.wait(delay)
@@ -7,9 +7,21 @@
 
 
 def get_generator_prompt(
-    figure_number: str, figure_caption: str, context: str, type_of_question: str
+    figure_number: str,
+    figure_caption: str,
+    context: str,
+    type_of_question: str,
+    num_questions: int = 1,
 ) -> str:
     assert type_of_question in ["MCQ", "Short-Answer", "Long-Answer"]
+    assert num_questions >= 1
+
+    batch_instructions = ""
+    if num_questions > 1:
+        batch_instructions = f"""
+    10) Develop {num_questions} distinct questions following the instructions above for each of them. The questions must not ask about the same diagnosis, finding, or fact.
+    11) Your output should be a Python list of the {num_questions} question dictionaries: [{{...}}, {{...}}, ...]
+        """
 
     question_instructions = {
         "MCQ": """ 
@@ -48,7 +60,7 @@ def get_generator_prompt(
        {{'question': 'Your question here (including the choices if MCQ question)', 'options': "The A), B), C), D), and E) options here', 'answer': 'The answer here'}}
        and the in the follwing dictionary format if the question is not MCQ:
        {{'question': 'Your question here (including the choices if MCQ question)', 'answer': 'The answer here'}}
-    
+    {batch_instructions}
     -- Inputs --
     
     ## String Containing the Figure Number
@@ -74,8 +86,14 @@ def get_generator_prompt(
 
 
 def get_contenteditor_prompt(
-    figure_caption: str, qa_dict_string: str, question_type: str
+    figure_caption: str, qa_dict_string: str, question_type: str, num_questions: int = 1
 ) -> str:
+    batch_instructions = ""
+    if num_questions > 1:
+        batch_instructions = f"""
+    6) The question-answer pair below is a Python list of {num_questions} dictionaries. Apply the steps above to each dictionary separately, and output a Python list of the {num_questions} edited dictionaries in the same order.
+        """
+
     prompt = f"""
     
     -- Instructions --
@@ -99,7 +117,7 @@ def get_contenteditor_prompt(
     {{'question': 'Your question here (including the choices if MCQ question)', 'options': "The A), B), C), D), and E) options here', 'answer': 'The answer here'}}
     and the in the follwing format if the question type is not MCQ:
     {{'question': 'Your question here', 'answer': 'The answer here'}}
-    
+    {batch_instructions}
     --- Example 1 ---
     
     **Input:**
@@ -165,7 +183,13 @@ def get_contenteditor_prompt(
 # get_formateditor_prompt
 
 
-def get_formateditor_prompt(qa_dict_string: str) -> str:
+def get_formateditor_prompt(qa_dict_string: str, num_questions: int = 1) -> str:
+    batch_instructions = ""
+    if num_questions > 1:
+        batch_instructions = f"""
+        7. The input string is a list of {num_questions} question-answer dictionaries. Apply the instructions above to each of them, and make sure that the output is a Python list of the {num_questions} dictionaries that can be converted with the eval() function.
+        """
+
     prompt = f"""
     ---
     Read the provided input string below and modify it so that it can be converted into a Python dictionary with the eval() function.
@@ -181,6 +205,7 @@ def get_formateditor_prompt(qa_dict_string: str) -> str:
         4. If there is any ' or " in the string except for the ones that are used to enclose the keys and values, replace them with `.
         5. If the input string is not correctly formatted or lacks the necessary keys, correct the format and/or include the missing elements.
         6. The output should be a Python dictionary with "question", "answer", and an optional "options" keys.
+        {batch_instructions}
 
     --- Example ---
         input: "{{'question': 'What is radiologists' job?', 'answer: 'Reading medical images'}}"
@@ -0,0 +1,341 @@
+##########################################################################################
+# Description: A script containing the compact columnar question bank of figures.
+##########################################################################################
+
+import json
+import random
+from array import array
+import numpy as np
+import radqg.configs as configs
+from radqg.parse_html import get_caption_body
+
+# ----------------------------------------------------------------------------------------
+# get_panels
+
+
+def get_panels(caption: str, metadata: dict) -> list[tuple[str, str, str]]:
+    """A function to get the names, paths, and captions of the panels of a figure from
+    its entry in the caption collection."""
+
+    figure_names = json.loads(metadata["figure_names"])
+    figure_paths = json.loads(metadata["figure_paths"])
+    return [
+        (figure_name, figure_path, caption.replace(figure_names[0], figure_name, 1))
+        for figure_name, figure_path in zip(figure_names, figure_paths)
+    ]
+
+
+# ----------------------------------------------------------------------------------------
+# StringColumn
+
+
+class StringColumn:
+    """A class for a column of strings stored contiguously as UTF-8 bytes with the
+    offsets of each string, instead of as one Python object per string."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        """The constructor of the StringColumn class."""
+
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: list[str]) -> "StringColumn":
+        """A method to build a column from a list of strings."""
+
+        encoded = [string.encode() for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[self.offsets[i] : self.offsets[i + 1]].tobytes().decode()
+
+
+# ----------------------------------------------------------------------------------------
+# StringColumnBuilder
+
+
+class StringColumnBuilder:
+    """A class for building a column of strings a string at a time, in a growing
+    buffer of UTF-8 bytes and an array of offsets."""
+
+    def __init__(self):
+        """The constructor of the StringColumnBuilder class."""
+
+        self.data = bytearray()
+        self.offsets = array("q", [0])
+
+    def append(self, string: str):
+        """A method to add a string to the column."""
+
+        self.data += string.encode()
+        self.offsets.append(len(self.data))
+
+    def build(self) -> StringColumn:
+        """A method to get the column, which shares the memory of the builder."""
+
+        return StringColumn(
+            np.frombuffer(self.data, dtype=np.uint8),
+            np.frombuffer(self.offsets, dtype=np.int64),
+        )
+
+
+# ----------------------------------------------------------------------------------------
+# QBank
+
+
+class QBank:
+    """A class for the question bank of a generator: the article, path, and caption of
+    each figure (panel), looked up by the figure id (its row), and the distance of its
+    caption to the topic, if any. The article names are interned as integer ids, and
+    the paths, the labels of the captions (e.g., "Figure 2a."), and the distinct bodies
+    of the captions (shared by the panels of a figure) are stored contiguously. The
+    bank can be saved and loaded, and `sampler` samples the figure ids to draw (see
+    `new_sampler`)."""
+
+    def __init__(
+        self,
+        article_names: list[str],
+        article_ids: np.ndarray,
+        figure_paths: StringColumn,
+        caption_labels: StringColumn,
+        caption_ids: np.ndarray,
+        caption_bodies: StringColumn,
+        distances: np.ndarray = None,
+    ):
+        """The constructor of the QBank class."""
+
+        self.article_names = article_names
+        self.article_ids = article_ids
+        self.figure_paths = figure_paths
+        self.caption_labels = caption_labels
+        self.caption_ids = caption_ids
+        self.caption_bodies = caption_bodies
+        self.distances = distances
+        self.sampler = self.new_sampler()
+
+    @classmethod
+    def from_figures(
+        cls,
+        article_names: list[str],
+        figure_paths: list[str],
+        captions: list[str],
+        distances: list[float] = None,
+    ) -> "QBank":
+        """A method to build a question bank from the article names, paths, captions,
+        and distances (if any) of its figures."""
+
+        builder = QBankBuilder(with_distances=distances is not None)
+        for i, (article_name, figure_path, caption) in enumerate(
+            zip(article_names, figure_paths, captions)
+        ):
+            builder.add_figure(
+                article_name,
+                figure_path,
+                caption,
+                distances[i] if distances is not None else None,
+            )
+        return builder.build()
+
+    @classmethod
+    def from_entries(
+        cls, captions: list[str], metadatas: list[dict], distances: list[float] = None
+    ) -> "QBank":
+        """A method to build a question bank from entries of the caption collection,
+        expanded into their panels, which share the distance of their caption."""
+
+        builder = QBankBuilder(with_distances=distances is not None)
+        builder.add_entries(captions, metadatas, distances)
+        return builder.build()
+
+    @classmethod
+    def from_collection(
+        cls, collection, page_size: int = configs.QBANK_PAGE_SIZE
+    ) -> "QBank":
+        """A method to build a question bank from all the entries of the caption
+        collection, loaded a page at a time and added to the columns as it arrives, so
+        that only one page of entries is held as Python objects."""
+
+        builder, offset = QBankBuilder(), 0
+        while True:
+            out = collection.get(
+                include=["documents", "metadatas"], limit=page_size, offset=offset
+            )
+            builder.add_entries(out["documents"], out["metadatas"])
+            offset += page_size
+            if len(out["documents"]) < page_size:
+                break
+        return builder.build()
+
+    def __len__(self) -> int:
+        return len(self.article_ids)
+
+    def get_article_name(self, figure_id: int) -> str:
+        """A method to get the article name of a figure."""
+
+        return self.article_names[self.article_ids[figure_id]]
+
+    def get_figure_path(self, figure_id: int) -> str:
+        """A method to get the path of a figure."""
+
+        return self.figure_paths[figure_id]
+
+    def get_caption(self, figure_id: int) -> str:
+        """A method to get the caption of a figure."""
+
+        body = self.caption_bodies[self.caption_ids[figure_id]]
+        return self.caption_labels[figure_id] + body
+
+    def get(self, figure_id: int) -> tuple[str, str, str]:
+        """A method to get the article name, path, and caption of a figure."""
+
+        return (
+            self.get_article_name(figure_id),
+            self.get_figure_path(figure_id),
+            self.get_caption(figure_id),
+        )
+
+    def new_sampler(self) -> iter:
+        """A method to create a sampler of the figure ids: weighted by the distances of
+        the captions to the topic (the closer, the likelier) if there is a topic, or
+        else a random permutation."""
+
+        if self.distances is None:
+            return self._random_sampler(len(self))
+        return self._weighted_sampler(self.distances)
+
+    @staticmethod
+    def _weighted_sampler(distances: np.ndarray) -> iter:
+        """An internal method to generate a weighted sampler based on the distances of
+        the figure captions and the user-specified topic of interest."""
+
+        # Weights of 1 / distance ** 50, scaled by the largest one to avoid overflows
+        log_distances = np.log(distances.astype(np.float64) + 1e-6)
+        weights = np.exp(-50 * (log_distances - log_distances.min()))
+        cumulative_weights = np.cumsum(weights)
+
+        while True:
+            # Randomly selecting an index based on weights
+            selected_index = np.searchsorted(
+                cumulative_weights, random.random() * cumulative_weights[-1], "right"
+            )
+            yield int(min(selected_index, len(distances) - 1))
+
+    @staticmethod
+    def _random_sampler(num_figures: int) -> iter:
+        """An internal method to generate a random sampler."""
+
+        indices = list(range(num_figures))
+        random.shuffle(indices)
+        for index in indices:
+            yield index
+
+    def save(self, path: str):
+        """A method to save the question bank to a .npz file."""
+
+        arrays = {
+            "article_names": np.frombuffer(
+                json.dumps(self.article_names).encode(), dtype=np.uint8
+            ),
+            "article_ids": self.article_ids,
+            "caption_ids": self.caption_ids,
+        }
+        for name in ["figure_paths", "caption_labels", "caption_bodies"]:
+            arrays[f"{name}_data"] = getattr(self, name).data
+            arrays[f"{name}_offsets"] = getattr(self, name).offsets
+        if self.distances is not None:
+            arrays["distances"] = self.distances
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "QBank":
+        """A method to load a question bank saved by `save`."""
+
+        with np.load(path) as data:
+            columns = {
+                name: StringColumn(data[f"{name}_data"], data[f"{name}_offsets"])
+                for name in ["figure_paths", "caption_labels", "caption_bodies"]
+            }
+            return cls(
+                json.loads(data["article_names"].tobytes().decode()),
+                data["article_ids"],
+                columns["figure_paths"],
+                columns["caption_labels"],
+                data["caption_ids"],
+                columns["caption_bodies"],
+                data["distances"] if "distances" in data else None,
+            )
+
+
+# ----------------------------------------------------------------------------------------
+# QBankBuilder
+
+
+class QBankBuilder:
+    """A class for building a question bank a figure at a time, interning the article
+    names and the bodies of the captions, and appending to the columns as it goes (see
+    QBank)."""
+
+    def __init__(self, with_distances: bool = False):
+        """The constructor of the QBankBuilder class."""
+
+        self.article_index, self.caption_index = dict(), dict()
+        self.article_ids, self.caption_ids = array("i"), array("i")
+        self.figure_paths = StringColumnBuilder()
+        self.caption_labels = StringColumnBuilder()
+        self.caption_bodies = StringColumnBuilder()
+        self.distances = array("f") if with_distances else None
+
+    def add_figure(
+        self, article_name: str, figure_path: str, caption: str, distance: float = None
+    ):
+        """A method to add a figure (panel) to the question bank."""
+
+        self.article_ids.append(
+            self.article_index.setdefault(article_name, len(self.article_index))
+        )
+        self.figure_paths.append(figure_path)
+        body = get_caption_body(caption)
+        if body not in self.caption_index:
+            self.caption_index[body] = len(self.caption_index)
+            self.caption_bodies.append(body)
+        self.caption_ids.append(self.caption_index[body])
+        self.caption_labels.append(caption[: len(caption) - len(body)])
+        if self.distances is not None:
+            self.distances.append(distance)
+
+    def add_entries(
+        self, captions: list[str], metadatas: list[dict], distances: list[float] = None
+    ):
+        """A method to add entries of the caption collection, expanded into their
+        panels, which share the distance of their caption."""
+
+        for i, (caption, metadata) in enumerate(zip(captions, metadatas)):
+            for _, figure_path, panel_caption in get_panels(caption, metadata):
+                self.add_figure(
+                    metadata["article_name"],
+                    figure_path,
+                    panel_caption,
+                    distances[i] if distances is not None else None,
+                )
+
+    def build(self) -> QBank:
+        """A method to get the question bank, which shares the memory of the builder."""
+
+        return QBank(
+            list(self.article_index),
+            np.frombuffer(self.article_ids, dtype=np.int32),
+            self.figure_paths.build(),
+            self.caption_labels.build(),
+            np.frombuffer(self.caption_ids, dtype=np.int32),
+            self.caption_bodies.build(),
+            (
+                np.frombuffer(self.distances, dtype=np.float32)
+                if self.distances is not None
+                else None
+            ),
+        )
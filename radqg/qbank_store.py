@@ -0,0 +1,283 @@
+##########################################################################################
+# Description: A script containing an offline store of pre-generated questions.
+##########################################################################################
+
+import datetime
+import json
+import sqlite3
+import threading
+import radqg.configs as configs
+from radqg.generator import Generator
+from radqg.qbank import QBank
+
+# ----------------------------------------------------------------------------------------
+# QuestionBankStore
+
+
+class QuestionBankStore:
+    """A class for storing pre-generated questions in an indexed SQLite database and
+    serving them with the same figure sampling as the Generator's question bank."""
+
+    def __init__(self, db_path: str = configs.QBANK_DB_PATH):
+        """The constructor of the QuestionBankStore class."""
+
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS questions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    article_name TEXT NOT NULL,
+                    figure_path TEXT NOT NULL,
+                    caption TEXT NOT NULL,
+                    context TEXT,
+                    type_of_question TEXT NOT NULL,
+                    qa_dict TEXT NOT NULL,
+                    generator_model TEXT,
+                    content_editor_model TEXT,
+                    format_editor_model TEXT,
+                    total_tokens INTEGER,
+                    total_cost REAL,
+                    served_count INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                """
+                CREATE INDEX IF NOT EXISTS questions_by_figure
+                ON questions (figure_path, type_of_question, served_count)
+                """
+            )
+
+    def close(self):
+        """A method to close the connection to the database."""
+
+        self._connection.close()
+
+    def add(
+        self,
+        article_name: str,
+        figure_path: str,
+        caption: str,
+        type_of_question: str,
+        qa_dict: dict,
+        context: str = None,
+        models: tuple[str, str, str] = (None, None, None),
+        total_tokens: int = None,
+        total_cost: float = None,
+    ) -> int:
+        """A method to add a generated question to the store and return its id."""
+
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                """
+                INSERT INTO questions (
+                    article_name, figure_path, caption, context, type_of_question,
+                    qa_dict, generator_model, content_editor_model,
+                    format_editor_model, total_tokens, total_cost, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    article_name,
+                    figure_path,
+                    caption,
+                    context,
+                    type_of_question,
+                    json.dumps(qa_dict),
+                    *models,
+                    total_tokens,
+                    total_cost,
+                    datetime.datetime.now().isoformat(),
+                ),
+            )
+        return cursor.lastrowid
+
+    def count(self, figure_path: str = None, type_of_question: str = None) -> int:
+        """A method to count the stored questions, optionally for one figure and/or one
+        question type."""
+
+        query, params = "SELECT COUNT(*) FROM questions WHERE 1 = 1", list()
+        if figure_path is not None:
+            query += " AND figure_path = ?"
+            params.append(figure_path)
+        if type_of_question is not None:
+            query += " AND type_of_question = ?"
+            params.append(type_of_question)
+        with self._lock:
+            return self._connection.execute(query, params).fetchone()[0]
+
+    def build(
+        self,
+        generator: Generator,
+        qa_fn: callable,
+        questions_per_figure: int = configs.QBANK_QUESTIONS_PER_FIGURE,
+        question_types: list[str] = ["MCQ", "Short-Answer", "Long-Answer"],
+        max_spend: float = None,
+        questions_per_call: int = configs.QBANK_QUESTIONS_PER_CALL,
+        max_attempts: int = configs.QBANK_MAX_ATTEMPTS,
+    ) -> float:
+        """A method to run the generation pipeline over every figure of the generator's
+        question bank until the store holds `questions_per_figure` questions of each
+        type for every figure. Questions already in the store are kept, so an
+        interrupted build can be resumed. Up to `questions_per_call` questions of a
+        figure are generated together, sharing the prompt and context tokens (the qa_fn
+        must accept the `num_questions` argument if it is more than one). A failed run
+        is resumed from its checkpoint (the qa_fn must accept the `checkpoint`
+        argument, see `radqg.llm.openai.qa`), and a figure is skipped for a question
+        type after `max_attempts` failed runs. Every run is charged to the spend,
+        including the failed ones. The models that served the stages of each question
+        are stored with it. Returns the dollars spent."""
+
+        qbank = generator.setup_qbank()
+        total_spend = 0.0
+        for figure_id in range(len(qbank)):
+            article_name, figpath, caption = qbank.get(figure_id)
+            for question_type in question_types:
+                missing = questions_per_figure - self.count(figpath, question_type)
+                checkpoint, charged, num_failures = dict(), 0.0, 0
+                while missing > 0:
+                    if max_spend is not None and total_spend >= max_spend:
+                        print(f"The spend cap of ${max_spend} has been reached.")
+                        return total_spend
+                    num_questions = min(missing, questions_per_call)
+                    qa_kwargs = dict()
+                    if num_questions > 1:
+                        qa_kwargs["num_questions"] = num_questions
+                    try:
+                        qa_out, _, _, _, context, tokens, cost = generator.generate_qa(
+                            qa_fn=qa_fn,
+                            article_name=article_name,
+                            figpath=figpath,
+                            caption=caption,
+                            type_of_question=question_type,
+                            complete_return=True,
+                            checkpoint=checkpoint,
+                            **qa_kwargs,
+                        )
+                    except AssertionError:
+                        num_failures += 1
+                        if num_failures >= max_attempts:
+                            print(
+                                f"No {question_type} question could be generated for "
+                                f"{figpath} in {max_attempts} attempts; skipping it."
+                            )
+                            break
+                        print("AssertionError occured; trying again...")
+                        continue
+                    finally:
+                        spent = checkpoint.get("spend", {}).get("cost", 0.0)
+                        total_spend += spent - charged
+                        charged = spent
+
+                    # Storing the models that served the stages (see `_run_stage`), which
+                    # may be fallbacks of the configured ones; a skipped stage has none
+                    models = tuple(
+                        checkpoint.get(stage, {}).get("model")
+                        for stage in ["generator", "content_editor", "format_editor"]
+                    )
+
+                    # The tokens and cost of a batch are split between its questions
+                    qa_dicts = qa_out if num_questions > 1 else [qa_out]
+                    for qa_dict in qa_dicts:
+                        self.add(
+                            article_name,
+                            figpath,
+                            caption,
+                            question_type,
+                            qa_dict,
+                            context=context,
+                            models=models,
+                            total_tokens=tokens // len(qa_dicts),
+                            total_cost=cost / len(qa_dicts),
+                        )
+                    missing -= len(qa_dicts)
+                    checkpoint, charged = dict(), 0.0
+        return total_spend
+
+    def setup_qbank(self, topic: str = None, generator: Generator = None) -> QBank:
+        """A method to set up the question bank of the stored figures. As with the
+        Generator's `setup_qbank` method, figures are sampled randomly, or weighted by
+        their relevance to the topic if one is given (which requires the generator that
+        holds the caption collection)."""
+
+        if topic is not None:
+            assert generator is not None, "A generator is needed to search by topic."
+            return generator.setup_qbank(topic)
+
+        with self._lock:
+            rows = self._connection.execute(
+                """
+                SELECT article_name, figure_path, MIN(caption) AS caption
+                FROM questions GROUP BY article_name, figure_path
+                """
+            ).fetchall()
+        return QBank.from_figures(
+            [row["article_name"] for row in rows],
+            [row["figure_path"] for row in rows],
+            [row["caption"] for row in rows],
+        )
+
+    def serve(
+        self,
+        type_of_question: str,
+        qbank: QBank,
+        max_draws: int = 1000,
+    ) -> dict:
+        """A method to serve a stored question of the given type for the next sampled
+        figure that has one, preferring the least served question of that figure. The
+        stored questions can be served again, so the figures are sampled anew once the
+        sampler of the question bank is exhausted.
+
+        >>> store = QuestionBankStore(":memory:")
+        >>> for i in range(2):
+        ...     _ = store.add("a.html", f"fig{i}.png", f"Figure {i}.", "MCQ", {})
+        >>> qbank = store.setup_qbank()
+        >>> sorted(store.serve("MCQ", qbank)["figure_path"] for _ in range(6))
+        ['fig0.png', 'fig0.png', 'fig0.png', 'fig1.png', 'fig1.png', 'fig1.png']
+        """
+
+        for _ in range(max_draws):
+            try:
+                figure_id = next(qbank.sampler)
+            except StopIteration:
+                if len(qbank) == 0:
+                    break
+                qbank.sampler = qbank.new_sampler()
+                figure_id = next(qbank.sampler)
+            figure_path = qbank.get_figure_path(figure_id)
+            with self._lock, self._connection:
+                row = self._connection.execute(
+                    """
+                    SELECT * FROM questions
+                    WHERE figure_path = ? AND type_of_question = ?
+                    ORDER BY served_count, RANDOM() LIMIT 1
+                    """,
+                    (figure_path, type_of_question),
+                ).fetchone()
+                if row is None:
+                    continue
+                self._connection.execute(
+                    "UPDATE questions SET served_count = served_count + 1 WHERE id = ?",
+                    (row["id"],),
+                )
+            item = dict(row)
+            item["qa_dict"] = json.loads(item["qa_dict"])
+            return item
+        raise LookupError(f"No stored {type_of_question} question could be found.")
+
+
+# ----------------------------------------------------------------------------------------
+# main
+
+if __name__ == "__main__":
+    from radqg.llm.openai import embed_fn as openai_embed_fn
+    from radqg.llm.openai import qa as openai_qa
+
+    generator = Generator(data_dir=configs.TOY_DATA_DIR, embed_fn=openai_embed_fn)
+    store = QuestionBankStore(configs.QBANK_DB_PATH)
+    spend = store.build(generator, openai_qa)
+    print(f"{store.count()} questions are stored in {store.db_path} (${spend:.2f}).")
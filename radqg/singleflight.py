@@ -0,0 +1,52 @@
+##########################################################################################
+# Description: A script containing the coalescing of concurrent identical calls.
+##########################################################################################
+
+import threading
+import radqg.tracing as tracing
+
+# ----------------------------------------------------------------------------------------
+# SingleFlight
+
+
+class SingleFlight:
+    """A class for coalescing concurrent calls with the same key: the first caller runs
+    the call, and the callers that arrive while it is in flight wait for it and share
+    its result (or its error) instead of repeating it. Nothing is cached once the call
+    has finished."""
+
+    def __init__(self):
+        """The constructor of the SingleFlight class."""
+
+        self._calls = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key: tuple, fn: callable):
+        """A method to call `fn` (with no arguments) unless a call with the same key is
+        already in flight, in which case its result is returned. The first item of the
+        key is used as the kind of the call in the metrics."""
+
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+        tracing.increment("singleflight_calls_total", kind=key[0], shared=not is_leader)
+
+        if not is_leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+        except Exception as error:
+            call["error"] = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+        return call["result"]
@@ -0,0 +1,527 @@
+##########################################################################################
+# Description: A script containing the read-only snapshots of the generator's collections.
+##########################################################################################
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Union
+import numpy as np
+
+# ----------------------------------------------------------------------------------------
+# Configurations
+
+SNAPSHOT_VERSION = 6  # Bumped on each change of the files or columns of a snapshot.
+COLUMNS_FILE_NAME = "snapshot.json"
+CAPTION_EMBEDDINGS_NAME = "caption_embeddings"
+CHUNK_EMBEDDINGS_NAME = "chunk_embeddings"
+SEARCH_BLOCK_SIZE = 4096  # Rows of quantized embeddings converted at a time.
+EMBEDDING_FILE_NAME = "embedding.npz"
+STALE_STAGING_AGE = 3600  # Seconds after which an unpublished staging dir is removed.
+
+# ----------------------------------------------------------------------------------------
+# StaleSnapshotError
+
+
+class StaleSnapshotError(Exception):
+    """An exception raised when a snapshot was not built from the expected corpus, or by
+    another version of this script."""
+
+
+# ----------------------------------------------------------------------------------------
+# corpus_fingerprint
+
+
+def embedding_signature(embed_fn: callable) -> str:
+    """A function to describe an embedding function by its name and settings: the
+    default arguments of a function (e.g., the model), or the scalar attributes of an
+    object (e.g., the dimension of a LocalEmbedding)."""
+
+    if inspect.isfunction(embed_fn):
+        return f"{embed_fn.__module__}.{embed_fn.__qualname__}{embed_fn.__defaults__}"
+    settings = sorted(
+        (key, value)
+        for key, value in getattr(embed_fn, "__dict__", dict()).items()
+        if isinstance(value, (bool, int, float, str))
+    )
+    kind = type(embed_fn)
+    return f"{kind.__module__}.{kind.__qualname__}{settings}"
+
+
+def corpus_fingerprint(
+    data_dir: str,
+    selected_articles: list[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    embedding: str = "",
+    cleaning: list = None,
+) -> str:
+    """A function to hash the HTML files of a corpus (their absolute paths and raw
+    bytes), the selected articles, the chunking arguments, the embedding (see
+    `embedding_signature`), and the cleaning arguments (if the articles are cleaned), so
+    that a snapshot can be matched with the corpus it was built from without parsing
+    the articles. All the files are hashed, as the articles are cleaned of the
+    paragraphs they share with the others (see `clean_articles`)."""
+
+    digest = hashlib.sha256(f"{chunk_size}:{chunk_overlap}:{embedding}".encode())
+    digest.update(json.dumps(cleaning).encode())
+    if selected_articles is not None:
+        digest.update(json.dumps(sorted(selected_articles)).encode())
+    for entry in sorted(os.listdir(data_dir)):
+        if entry.endswith(".html"):
+            file_path = os.path.abspath(os.path.join(data_dir, entry))
+            digest.update(file_path.encode())
+            with open(file_path, "rb") as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()
+
+
+# ----------------------------------------------------------------------------------------
+# SnapshotCollection
+
+
+class SnapshotCollection:
+    """A class for a read-only collection whose embeddings are a (memory-mapped) matrix
+    of unit vectors, with the `count`, `get`, and `query` methods of a Chroma collection
+    (cosine distances), so that it can replace one in the generator. If a `quantized`
+    copy of the embeddings is given (float16, or int8 with per-vector `scales`), it is
+    searched instead, and the `rescore_factor` times `n_results` best candidates are
+    re-scored with the full-precision embeddings (if the factor is not zero)."""
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        ids: list[str],
+        documents: list[str],
+        metadata_columns: dict[str, list],
+        embed_fn: callable,
+        quantized: np.ndarray = None,
+        scales: np.ndarray = None,
+        rescore_factor: int = 0,
+    ):
+        """The constructor of the SnapshotCollection class."""
+
+        self.embeddings = embeddings
+        self.ids = ids
+        self.documents = documents
+        self.metadata_columns = metadata_columns
+        self.embed_fn = embed_fn
+        self.quantized = quantized
+        self.scales = scales
+        self.rescore_factor = rescore_factor
+
+    def count(self) -> int:
+        """A method to get the number of items in the collection."""
+
+        return len(self.ids)
+
+    def _get_metadatas(self, indices: list[int]) -> list[dict]:
+        """An internal method to build the metadata dictionaries of some items."""
+
+        return [
+            {key: column[i] for key, column in self.metadata_columns.items()}
+            for i in indices
+        ]
+
+    def get(
+        self,
+        include: list[str] = ["documents", "metadatas"],
+        limit: int = None,
+        offset: int = 0,
+    ) -> dict:
+        """A method to get the items of the collection, or a page of `limit` items from
+        `offset`."""
+
+        stop = self.count() if limit is None else min(offset + limit, self.count())
+        indices = range(offset, stop)
+        out = {"ids": list(self.ids[offset:stop])}
+        out["documents"] = (
+            list(self.documents[offset:stop]) if "documents" in include else None
+        )
+        out["metadatas"] = (
+            self._get_metadatas(indices) if "metadatas" in include else None
+        )
+        out["embeddings"] = (
+            np.asarray(self.embeddings[offset:stop]).tolist()
+            if "embeddings" in include
+            else None
+        )
+        return out
+
+    def _search(
+        self, query: np.ndarray, n_results: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """An internal method to find the indices and cosine similarities of the
+        `n_results` items closest to a unit query vector, from the closest."""
+
+        if self.quantized is None:
+            similarities = self.embeddings @ query
+        else:
+            similarities = self._quantized_similarities(query)
+            if self.rescore_factor:
+                # Re-scoring the best candidates reads only their full-precision rows
+                candidates = self._top(similarities, n_results * self.rescore_factor)
+                candidates.sort()
+                similarities = np.full(len(similarities), -np.inf, dtype=np.float32)
+                similarities[candidates] = self.embeddings[candidates] @ query
+        indices = self._top(similarities, n_results)
+        indices = indices[np.argsort(-similarities[indices], kind="stable")]
+        return indices, similarities[indices]
+
+    @staticmethod
+    def _top(similarities: np.ndarray, n: int) -> np.ndarray:
+        """An internal method to find the indices of the `n` largest similarities."""
+
+        if n < len(similarities):
+            return np.argpartition(-similarities, n - 1)[:n]
+        return np.arange(len(similarities))
+
+    def _quantized_similarities(self, query: np.ndarray) -> np.ndarray:
+        """An internal method to compute the approximate similarities of a query with
+        the quantized embeddings, converting a block of rows at a time."""
+
+        similarities = np.empty(len(self.quantized), dtype=np.float32)
+        for start in range(0, len(self.quantized), SEARCH_BLOCK_SIZE):
+            block = slice(start, start + SEARCH_BLOCK_SIZE)
+            similarities[block] = self.quantized[block].astype(np.float32) @ query
+            if self.scales is not None:
+                similarities[block] *= self.scales[block]
+        return similarities
+
+    def query(
+        self,
+        query_texts: Union[str, list[str]],
+        n_results: int = 10,
+        include: list[str] = ["documents", "metadatas", "distances"],
+    ) -> dict:
+        """A method to find the `n_results` items closest to each query text."""
+
+        if isinstance(query_texts, str):
+            query_texts = [query_texts]
+        queries = np.asarray(self.embed_fn(query_texts), dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        n_results = min(n_results, self.count())
+
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query in queries:
+            indices, similarities = self._search(query, n_results)
+            out["ids"].append([self.ids[i] for i in indices])
+            out["documents"].append([self.documents[i] for i in indices])
+            out["metadatas"].append(self._get_metadatas(indices))
+            out["distances"].append((1 - similarities).tolist())
+        for key in ["documents", "metadatas", "distances"]:
+            if key not in include:
+                out[key] = None
+        return out
+
+
+# ----------------------------------------------------------------------------------------
+# write_snapshot
+
+
+def _normalize(embeddings: list[list[float]]) -> np.ndarray:
+    """An internal function to convert embeddings to a matrix of unit vectors."""
+
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def _save_embeddings(
+    snapshot_dir: str, name: str, embeddings: np.ndarray, precisions: list[str]
+):
+    """An internal function to save a matrix of embeddings at full precision (needed to
+    re-score the quantized searches), and at half precision and/or as int8 values with
+    a scale for each vector if "float16" and/or "int8" are in `precisions`."""
+
+    np.save(os.path.join(snapshot_dir, f"{name}.npy"), embeddings)
+    if "float16" in precisions:
+        np.save(
+            os.path.join(snapshot_dir, f"{name}_float16.npy"),
+            embeddings.astype(np.float16),
+        )
+    if "int8" in precisions:
+        scales = np.abs(embeddings).max(axis=1) / 127
+        scales[scales == 0] = 1
+        np.save(
+            os.path.join(snapshot_dir, f"{name}_int8.npy"),
+            np.round(embeddings / scales[:, None]).astype(np.int8),
+        )
+        np.save(
+            os.path.join(snapshot_dir, f"{name}_int8_scales.npy"),
+            scales.astype(np.float32),
+        )
+
+
+def write_snapshot(
+    snapshot_dir: str,
+    fingerprint: str,
+    caption_out: dict,
+    article_outs: dict[str, dict],
+    article_list: list[dict],
+    precisions: list[str] = ("float32",),
+):
+    """A function to write a snapshot from the output of `get` (with the embeddings) of
+    the caption collection and of the collection of each article, and the list of the
+    articles (see `retrieve_articles`, without their full texts). The embeddings are
+    saved as .npy matrices, in the given `precisions` ("float32", "float16", and/or
+    "int8", see `_save_embeddings`), and the ids, documents, and metadata in a columnar
+    JSON file. The `snapshot_dir` is meant to be a staging directory
+    (see `staging_snapshot_dir`), published once written (see `publish_snapshot`)."""
+
+    assert all(precision in ["float32", "float16", "int8"] for precision in precisions)
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    # Captions, in the order of the collection
+    caption_metadatas = caption_out["metadatas"]
+    captions = {
+        "ids": caption_out["ids"],
+        "documents": caption_out["documents"],
+        "metadatas": {
+            key: [metadata[key] for metadata in caption_metadatas]
+            for key in [
+                "type",
+                "figure_path",
+                "article_name",
+                "figure_names",
+                "figure_paths",
+            ]
+        },
+    }
+    _save_embeddings(
+        snapshot_dir,
+        CAPTION_EMBEDDINGS_NAME,
+        _normalize(caption_out["embeddings"]),
+        precisions,
+    )
+
+    # Chunks of all the articles in one matrix, in the order of the articles' chunks
+    articles = {
+        "names": [],
+        "paths": [],
+        "offsets": [0],
+        "paragraphs": [],
+        "figure_mentions": [],
+    }
+    chunk_documents, chunk_section_titles, chunk_embeddings = list(), list(), list()
+    for article in article_list:
+        article_name = article["article_file_name"]
+        out = article_outs[article_name]
+        order = sorted(
+            range(len(out["ids"])), key=lambda i: out["metadatas"][i]["chunk_index"]
+        )
+        chunk_documents += [out["documents"][i] for i in order]
+        chunk_section_titles += [out["metadatas"][i]["section_title"] for i in order]
+        chunk_embeddings += [out["embeddings"][i] for i in order]
+        articles["names"].append(article_name)
+        articles["paths"].append(article["article_file_path"])
+        articles["offsets"].append(len(chunk_documents))
+        articles["paragraphs"].append(article["paragraphs"])
+        articles["figure_mentions"].append(article["figure_mentions"])
+    _save_embeddings(
+        snapshot_dir,
+        CHUNK_EMBEDDINGS_NAME,
+        _normalize(chunk_embeddings).reshape(len(chunk_documents), -1),
+        precisions,
+    )
+
+    # Writing the columns last, so that a snapshot without them is incomplete
+    with open(os.path.join(snapshot_dir, COLUMNS_FILE_NAME), "w") as file:
+        json.dump(
+            {
+                "version": SNAPSHOT_VERSION,
+                "fingerprint": fingerprint,
+                "precisions": sorted(set(precisions) | {"float32"}),
+                "captions": captions,
+                "articles": articles,
+                "chunks": {
+                    "documents": chunk_documents,
+                    "section_titles": chunk_section_titles,
+                },
+            },
+            file,
+        )
+
+
+# ----------------------------------------------------------------------------------------
+# publish_snapshot
+
+
+def remove_stale_staging_dirs(snapshot_dir: str, max_age: float = STALE_STAGING_AGE):
+    """A function to remove the staging directories (and links) of `snapshot_dir` left
+    by the exports that were interrupted, i.e., those that are not published and were
+    last modified more than `max_age` seconds ago (younger ones may still be written
+    by another process)."""
+
+    parent_dir = os.path.dirname(os.path.abspath(snapshot_dir))
+    if not os.path.isdir(parent_dir):
+        return
+    prefix = f"{os.path.basename(snapshot_dir)}."
+    published_dir = os.path.realpath(snapshot_dir)
+    now = time.time()
+    for entry in os.listdir(parent_dir):
+        path = os.path.join(parent_dir, entry)
+        if not entry.startswith(prefix):
+            continue
+        is_link = os.path.islink(path)
+        if not is_link and os.path.realpath(path) == published_dir:
+            continue
+        try:
+            if now - os.lstat(path).st_mtime < max_age:
+                continue
+            if is_link:
+                os.remove(path)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+def staging_snapshot_dir(snapshot_dir: str) -> str:
+    """A function to create a new directory, next to `snapshot_dir`, to write a snapshot
+    to before it is published there. The stale staging directories of interrupted
+    exports are removed first (see `remove_stale_staging_dirs`)."""
+
+    parent_dir = os.path.dirname(os.path.abspath(snapshot_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    remove_stale_staging_dirs(snapshot_dir)
+    return tempfile.mkdtemp(prefix=f"{os.path.basename(snapshot_dir)}.", dir=parent_dir)
+
+
+def publish_snapshot(staging_dir: str, snapshot_dir: str):
+    """A function to publish the snapshot written to `staging_dir` at `snapshot_dir`,
+    which is made a symbolic link to it and replaced atomically, so that the processes
+    opening the snapshot never see a partial one, even if several export it at once.
+    The snapshot published before is removed."""
+
+    previous_dir = None
+    if os.path.islink(snapshot_dir):
+        previous_dir = os.path.realpath(snapshot_dir)
+    elif os.path.isdir(snapshot_dir):
+        # A snapshot written in place, which cannot be replaced atomically
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    link_path = f"{staging_dir}.link"
+    os.symlink(os.path.basename(staging_dir), link_path)
+    os.replace(link_path, snapshot_dir)
+    if previous_dir is not None and previous_dir != os.path.realpath(staging_dir):
+        shutil.rmtree(previous_dir, ignore_errors=True)
+
+
+# ----------------------------------------------------------------------------------------
+# read_snapshot
+
+
+def _load_embeddings(
+    snapshot_dir: str, name: str, precision: str
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """An internal function to memory-map a matrix of embeddings, and its quantized
+    copy and scales for the given precision ("float32" has no quantized copy)."""
+
+    def load(suffix):
+        path = os.path.join(snapshot_dir, f"{name}{suffix}.npy")
+        return np.load(path, mmap_mode="r")
+
+    if precision == "float16":
+        return load(""), load("_float16"), None
+    if precision == "int8":
+        return load(""), load("_int8"), load("_int8_scales")
+    return load(""), None, None
+
+
+def read_snapshot(
+    snapshot_dir: str,
+    embed_fn: callable,
+    precision: str = "float32",
+    rescore_factor: int = 0,
+    fingerprint: str = None,
+) -> tuple[str, SnapshotCollection, dict[str, SnapshotCollection], list[dict]]:
+    """A function to open a snapshot, with its embeddings memory-mapped read-only so
+    that the processes that open it share one copy through the page cache. The
+    collections are searched with the embeddings of the given `precision` ("float32",
+    "float16", or "int8"), re-scoring `rescore_factor` times the requested results at
+    full precision (see SnapshotCollection). A StaleSnapshotError is raised if the
+    snapshot has another version, or another `fingerprint` than the given one, or was
+    not exported with the given `precision` (see `write_snapshot`). Returns
+    the fingerprint, the caption collection, the collection of each article, and the
+    list of the articles."""
+
+    with open(os.path.join(snapshot_dir, COLUMNS_FILE_NAME)) as file:
+        columns = json.load(file)
+    if columns["version"] != SNAPSHOT_VERSION:
+        raise StaleSnapshotError(
+            f"The snapshot has version {columns['version']} instead of {SNAPSHOT_VERSION}."
+        )
+    if fingerprint is not None and columns["fingerprint"] != fingerprint:
+        raise StaleSnapshotError("The snapshot was built from another corpus.")
+    assert precision in ["float32", "float16", "int8"]
+    if precision not in columns["precisions"]:
+        raise StaleSnapshotError(
+            f"The snapshot has no {precision} embeddings (only "
+            f"{', '.join(columns['precisions'])}); export it with this precision."
+        )
+
+    captions = columns["captions"]
+    embeddings, quantized, scales = _load_embeddings(
+        snapshot_dir, CAPTION_EMBEDDINGS_NAME, precision
+    )
+    caption_collection = SnapshotCollection(
+        embeddings,
+        captions["ids"],
+        captions["documents"],
+        captions["metadatas"],
+        embed_fn,
+        quantized,
+        scales,
+        rescore_factor,
+    )
+
+    # The collection of an article is a view of its rows of the chunk matrices
+    embeddings, quantized, scales = _load_embeddings(
+        snapshot_dir, CHUNK_EMBEDDINGS_NAME, precision
+    )
+    chunk_documents = columns["chunks"]["documents"]
+    chunk_section_titles = columns["chunks"]["section_titles"]
+    articles = columns["articles"]
+    article_collections, article_list = dict(), list()
+    for i, article_name in enumerate(articles["names"]):
+        start, end = articles["offsets"][i], articles["offsets"][i + 1]
+        article_collections[article_name] = SnapshotCollection(
+            embeddings[start:end],
+            [f"{article_name}_{j}" for j in range(end - start)],
+            chunk_documents[start:end],
+            {
+                "type": ["article"] * (end - start),
+                "article_path": [articles["paths"][i]] * (end - start),
+                "article_name": [article_name] * (end - start),
+                "chunk_index": list(range(end - start)),
+                "section_title": chunk_section_titles[start:end],
+            },
+            embed_fn,
+            quantized[start:end] if quantized is not None else None,
+            scales[start:end] if scales is not None else None,
+            rescore_factor,
+        )
+        article_list.append(
+            {
+                "article_file_path": articles["paths"][i],
+                "article_file_name": article_name,
+                "paragraphs": articles["paragraphs"][i],
+                "figure_mentions": {
+                    int(number): paragraph_indices
+                    for number, paragraph_indices in articles["figure_mentions"][
+                        i
+                    ].items()
+                },
+            }
+        )
+
+    return (
+        columns["fingerprint"],
+        caption_collection,
+        article_collections,
+        article_list,
+    )
@@ -0,0 +1,183 @@
+##########################################################################################
+# Description: A script containing lightweight tracing spans and metrics for the project.
+##########################################################################################
+
+import contextlib
+import json
+import threading
+import time
+
+# ----------------------------------------------------------------------------------------
+# Configurations
+
+DURATION_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+_hooks = list()
+_hooks_lock = threading.Lock()
+
+# ----------------------------------------------------------------------------------------
+# MetricsRegistry
+
+
+class MetricsRegistry:
+    """A class for collecting counters and span duration histograms, which can be
+    exported in the Prometheus text format or as JSON."""
+
+    def __init__(self, buckets: list[float] = DURATION_BUCKETS):
+        """The constructor of the MetricsRegistry class."""
+
+        self.buckets = buckets
+        self._counters = dict()
+        self._histograms = dict()
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """A method to increase a counter with the given labels."""
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """A method to record a value (e.g., a duration in seconds) in a histogram."""
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                key, {"count": 0, "sum": 0.0, "buckets": [0] * len(self.buckets)}
+            )
+            histogram["count"] += 1
+            histogram["sum"] += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+
+    def reset(self):
+        """A method to clear all the collected metrics."""
+
+        with self._lock:
+            self._counters = dict()
+            self._histograms = dict()
+
+    def to_json(self) -> str:
+        """A method to export the metrics as a JSON string."""
+
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self._counters.items()
+            ]
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram["count"],
+                    "sum": histogram["sum"],
+                    "buckets": dict(zip(map(str, self.buckets), histogram["buckets"])),
+                }
+                for (name, labels), histogram in self._histograms.items()
+            ]
+        return json.dumps({"counters": counters, "histograms": histograms}, indent=2)
+
+    def to_prometheus(self, prefix: str = "radqg_") -> str:
+        """A method to export the metrics in the Prometheus text exposition format."""
+
+        def format_labels(labels: tuple, extra: tuple = ()) -> str:
+            pairs = [f'{key}="{value}"' for key, value in labels + extra]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = list()
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {prefix}{name} counter")
+                for (key, labels), value in sorted(self._counters.items()):
+                    if key == name:
+                        lines.append(f"{prefix}{name}{format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for (key, labels), histogram in sorted(self._histograms.items()):
+                    if key != name:
+                        continue
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        le = format_labels(labels, (("le", bound),))
+                        lines.append(f"{prefix}{name}_bucket{le} {count}")
+                    le = format_labels(labels, (("le", "+Inf"),))
+                    lines.append(f"{prefix}{name}_bucket{le} {histogram['count']}")
+                    lines.append(
+                        f"{prefix}{name}_sum{format_labels(labels)} {histogram['sum']}"
+                    )
+                    lines.append(
+                        f"{prefix}{name}_count{format_labels(labels)} "
+                        f"{histogram['count']}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# ----------------------------------------------------------------------------------------
+# add_hook
+
+
+def add_hook(hook: callable):
+    """A function to register a hook that receives every finished span as a dictionary
+    with the "name", "start", "duration", "attributes", and "error" keys."""
+
+    with _hooks_lock:
+        _hooks.append(hook)
+
+
+# ----------------------------------------------------------------------------------------
+# remove_hook
+
+
+def remove_hook(hook: callable):
+    """A function to unregister a span hook."""
+
+    with _hooks_lock:
+        _hooks.remove(hook)
+
+
+# ----------------------------------------------------------------------------------------
+# increment
+
+
+def increment(name: str, value: float = 1, **labels):
+    """A function to increase a counter of the default metrics registry."""
+
+    registry.increment(name, value, **labels)
+
+
+# ----------------------------------------------------------------------------------------
+# span
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """A context manager to time a block of code. The yielded dictionary holds the
+    attributes of the span and can be updated from within the block. The duration is
+    recorded in the default metrics registry and the span is passed to the hooks."""
+
+    start = time.time()
+    start_counter = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start_counter
+        registry.observe("span_duration_seconds", duration, span=name)
+        if error is not None:
+            registry.increment("span_errors_total", span=name, error=error)
+        finished = {
+            "name": name,
+            "start": start,
+            "duration": duration,
+            "attributes": attributes,
+            "error": error,
+        }
+        with _hooks_lock:
+            hooks = list(_hooks)
+        for hook in hooks:
+            hook(finished)